@@ -51,3 +51,5 @@ CREATE TABLE IF NOT EXISTS grouplist (
     group_name TEXT NOT NULL,
     info TEXT
 );
+
+-- Indexes and later schema changes are applied by scripts/dbmigrate.py -u
@@ -64,7 +64,9 @@ async fn fetch_tasks_by_taskid(
     pool: &sqlx::Pool<sqlx::Postgres>,
     taskid: i32,
 ) -> HttpResponse {
-    let query_str = "SELECT t.taskno, t.pkgbase, t.repo, l.build_time, t.info FROM tasks t LEFT JOIN logs l ON t.logid = l.id WHERE t.taskid = $1 ORDER by t.taskno";
+    // taskno is a sparse order key, number the tasks by position instead;
+    // all_tasks and all_logs also hold what scripts/archive.py moved to history
+    let query_str = "SELECT (ROW_NUMBER() OVER (ORDER BY t.taskno))::int4 AS taskno, t.pkgbase, t.repo, l.build_time, t.info FROM all_tasks t LEFT JOIN all_logs l ON t.logid = l.id WHERE t.taskid = $1 ORDER by t.taskno";
     let rows = sqlx::query(query_str)
         .bind(taskid)
         .fetch_all(pool)
@@ -131,7 +133,7 @@ pub async fn get_tasks_by_build_time(
     };
 
     // Step 1: Find all distinct taskids that have records within this date
-    let count_query = "SELECT COUNT(DISTINCT t.taskid) FROM tasks t LEFT JOIN logs l ON t.logid = l.id WHERE l.build_time >= $1 AND l.build_time <= $2";
+    let count_query = "SELECT COUNT(DISTINCT t.taskid) FROM all_tasks t LEFT JOIN all_logs l ON t.logid = l.id WHERE l.build_time >= $1 AND l.build_time <= $2";
     let count_row = sqlx::query(count_query)
         .bind(&date_start_dt)
         .bind(&date_end_dt)
@@ -149,7 +151,7 @@ pub async fn get_tasks_by_build_time(
 
     if distinct_count == 1 {
         // Single taskid: return the same format as get_tasks
-        let taskid_row = sqlx::query("SELECT DISTINCT t.taskid FROM tasks t LEFT JOIN logs l ON t.logid = l.id WHERE l.build_time >= $1 AND l.build_time <= $2")
+        let taskid_row = sqlx::query("SELECT DISTINCT t.taskid FROM all_tasks t LEFT JOIN all_logs l ON t.logid = l.id WHERE l.build_time >= $1 AND l.build_time <= $2")
             .bind(&date_start_dt)
             .bind(&date_end_dt)
             .fetch_one(pool.get_ref())
@@ -171,8 +173,8 @@ pub async fn get_tasks_by_build_time(
                 t.taskid,
                 MIN(t.taskno) as min_taskno,
                 COUNT(*) as count
-            FROM tasks t
-            LEFT JOIN logs l ON t.logid = l.id
+            FROM all_tasks t
+            LEFT JOIN all_logs l ON t.logid = l.id
             WHERE l.build_time >= $1 AND l.build_time <= $2
             GROUP BY t.taskid
         )
@@ -181,7 +183,7 @@ pub async fn get_tasks_by_build_time(
             t.pkgbase,
             ts.count
         FROM task_summary ts
-        JOIN tasks t ON t.taskid = ts.taskid AND t.taskno = ts.min_taskno
+        JOIN all_tasks t ON t.taskid = ts.taskid AND t.taskno = ts.min_taskno
         ORDER BY ts.taskid
     "#;
 
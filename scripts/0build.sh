@@ -99,6 +99,15 @@ done
 
 EXTRAARG="$@"
 
+# x86/loong versions of $PKGNAME, from compare86's cached index. Only asks
+# again when the pkgname changed (e.g. after patching).
+query_x86() {
+    if [[ "$QUERYNAME" != "$PKGNAME" ]]; then
+        QUERY=$($SCRIPTSPATH/compare86.py $REPOSWITCH -Q $PKGNAME)
+        QUERYNAME=$PKGNAME
+    fi
+}
+
 build_package() {
     # packages beloong only to loong
     if [[ -f $LOONGREPO/$PKGBASE/PKGBUILD ]]; then
@@ -123,7 +132,8 @@ build_package() {
             if [[ ! -z "$TESTING" ]]; then
                 REPOSWITCH=-${TESTING%ing}
             fi
-            PKGVER=`$SCRIPTSPATH/compare86.py $REPOSWITCH -p $PKGNAME |grep x86_64|awk -F= '{print $2}'`
+            query_x86
+            PKGVER=$(jq -r '.version // empty' <<< "$QUERY")
         fi
 
         # switch to the current release tag
@@ -150,7 +160,8 @@ build_package() {
     PKGVERREL=$(source PKGBUILD; echo $epoch${epoch:+:}$pkgver-$pkgrel)
 
     if [[ -z "$BUILDREPO" ]]; then
-        BUILDREPO=$($SCRIPTSPATH/compare86.py $REPOSWITCH -p $PKGNAME | awk '{print $5}' | tail -1)
+        query_x86
+        BUILDREPO=$(jq -r '.repo // empty' <<< "$QUERY")
         BUILDREPO=${BUILDREPO%-staging}
         BUILDREPO=${BUILDREPO%-testing}
     fi
@@ -174,8 +185,9 @@ build_package() {
     fi
 
     # Try to find the pkgver from tier0 server
-    _PKGVER=$($SCRIPTSPATH/compare86.py -sTp $PKGNAME | grep "$BUILDREPO$TESTING of loong64 with ver=$PKGVERREL" | awk -F= '{print $2}')
-    if [[ ! -z "$_PKGVER" ]]; then
+    query_x86
+    _PKGVER=$(jq -r --arg repo "$BUILDREPO$TESTING" '.loong[$repo] // empty' <<< "$QUERY")
+    if [[ "$_PKGVER" == "$PKGVERREL" || "$_PKGVER" == "$PKGVERREL".* ]]; then
         # Same package found in server. Incrementing point pkgrel...
         PKGREL=${_PKGVER#*-}
         PKGREL=$(echo $PKGREL + .1 | bc)
@@ -240,46 +252,24 @@ build_package() {
 
     # add the zst file to the local-repo
     if [[ "$EXITCODE" -eq 0 ]] && [[ ! "$DEBUG" == "yes" ]]; then
-        (source PKGBUILD;
+        FILES=$(source PKGBUILD;
         if [[ "$arch" == "any" ]]; then
             ARCH="any"
         else
             ARCH="loong64"
         fi
-        cd $LOCALREPO/temp-$BUILDREPO$TESTING/os/loong64
         for pkg in ${pkgname[@]}; do
-            FILENAME=$pkg-$PKGVERREL-$ARCH.pkg.tar.zst
-            if [ ! -f $FILENAME ]; then
-                REMOVEFLAG=-R
-            else
-                REMOVEFLAG=
-            fi
-            if [ "$BUILDER" = "loong1" ]; then
-                ssh -t $BUILDER "cd $BUILDPATH/$PKGBASE; [[ -f $FILENAME.sig ]] && rm -f $FILENAME.sig; gpg --detach-sign $FILENAME"
-                scp $BUILDER:$BUILDPATH/$PKGBASE/$FILENAME{,.sig} .
-            else # Only loong1 has the signing key
-                scp $BUILDER:$BUILDPATH/$PKGBASE/$FILENAME .
-                scp "./$FILENAME" "loong1:/mnt/repos/"
-                ssh -t loong1 "cd /mnt/repos; gpg --detach-sign $FILENAME"
-                scp loong1:/mnt/repos/$FILENAME.sig .
-                ssh -t loong1 "cd /mnt/repos; rm $FILENAME{,.sig} -f"
-            fi
-            chmod 664 $FILENAME{,.sig}
-            repo-add $REMOVEFLAG temp-$BUILDREPO$TESTING.db.tar.gz $FILENAME
+            echo $pkg-$PKGVERREL-$ARCH.pkg.tar.zst
         done)
-        DEBUGPKG=$PKGBASE-debug-$PKGVERREL-loong64.pkg.tar.zst
-        # echo $DEBUGPKG
-        if ssh -t $BUILDER "cd $BUILDPATH/$PKGBASE; if [ -f $DEBUGPKG ]; then rm -f $DEBUGPKG.sig; gpg --detach-sign $DEBUGPKG; fi; [ -f $BUILDPATH/$PKGBASE/$DEBUGPKG ]" 2>/dev/null; then
-            if [ "$BUILDER" = "loong1" ]; then
-                scp $BUILDER:$BUILDPATH/$PKGBASE/$DEBUGPKG{,.sig} $LOCALREPO/debug-pool
-            else # Only loong1 has the signing key
-                scp $BUILDER:$BUILDPATH/$PKGBASE/$DEBUGPKG $LOCALREPO/debug-pool
-                scp "$LOCALREPO/debug-pool/$DEBUGPKG" "loong1:/mnt/repos/"
-                ssh -t loong1 "cd /mnt/repos; gpg --detach-sign $DEBUGPKG"
-                scp loong1:/mnt/repos/$DEBUGPKG.sig $LOCALREPO/debug-pool
-                ssh -t loong1 "cd /mnt/repos; rm $DEBUGPKG{,.sig} -f"
-            fi
-            chmod 664 $LOCALREPO/debug-pool/$DEBUGPKG{,.sig}
+        # Fetch, sign (only loong1 has the signing key) and repo-add, batched
+        # with the other builds finishing now
+        if ! $SCRIPTSPATH/publish.py add --builder $BUILDER --builddir $BUILDPATH/$PKGBASE \
+            --repo $LOCALREPO/temp-$BUILDREPO$TESTING/os/loong64 --db temp-$BUILDREPO$TESTING.db.tar.gz \
+            --debug $PKGBASE-debug-$PKGVERREL-loong64.pkg.tar.zst --debug-pool $LOCALREPO/debug-pool $FILES; then
+            # The job is kept in the failed spool of publish.py
+            msg "Fail to publish $PKGBASE-$PKGVERREL."
+            msg "$PKGBASE-$PKGVERREL failed on $BUILDER, time cost: $TIMECOST"
+            return
         fi
         msg "$PKGBASE-$PKGVERREL built on $BUILDER, time cost: $TIMECOST"
     else
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Moves old build logs and finished task lists out of the live tables.
+
+Logs older than --days and finished tasks (tasklist 0) of all but the last
+--keep task lists go to monthly partitions of logs_history and
+tasks_history (dbmigrate.py migration 3), so dbcmd, parselog and the
+status site only scan recent rows. task --hist and the status site read
+both through the all_tasks and all_logs views. Run it daily from cron.
+
+History partitions older than --export-months can be dumped to
+<dir>/<partition>.csv.gz and dropped with --export; --restore loads such
+files back into history.
+"""
+
+import argparse
+import gzip
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import dbcmd
+
+LOG_DAYS = 90
+KEEP_LISTS = 50
+EXPORT_MONTHS = 24
+HISTORY_TABLES = ["logs_history", "tasks_history"]
+PARTITION_RE = re.compile(r"^(logs_history|tasks_history)_(\d{4})_(\d{2})$")
+
+
+def next_month(month):
+    return month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+
+
+def ensure_partitions(cursor, table, months):
+    for month in months:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_{month:%Y_%m} PARTITION OF {table} "
+                       "FOR VALUES FROM (%s) TO (%s)", (month, next_month(month)))
+
+
+def archive_tasks(cursor, keep, now):
+    """Moves the finished tasks of all but the last keep task lists, returns how many."""
+    cursor.execute("SELECT max(taskid) FROM tasks")
+    newest = cursor.fetchone()[0]
+    if newest is None:
+        return 0
+    # Whole task lists only, never one with tasks still queued
+    cursor.execute("""
+        SELECT taskid FROM tasks WHERE tasklist = 0 AND taskid <= %s
+        EXCEPT SELECT taskid FROM tasks WHERE tasklist != 0
+    """, (newest - keep,))
+    taskids = [row[0] for row in cursor.fetchall()]
+    if not taskids:
+        return 0
+
+    # A task is filed under the time of its log, or of the last log of its list
+    finished = """COALESCE(l.build_time, max(l.build_time) OVER (PARTITION BY t.taskid), %(now)s)"""
+    params = {"taskids": taskids, "now": now}
+    cursor.execute(f"""
+        SELECT DISTINCT date_trunc('month', {finished})
+        FROM tasks t LEFT JOIN all_logs l ON l.id = t.logid
+        WHERE t.tasklist = 0 AND t.taskid = ANY(%(taskids)s)
+    """, params)
+    ensure_partitions(cursor, "tasks_history", [row[0] for row in cursor.fetchall()])
+    cursor.execute(f"""
+        WITH t AS (
+            DELETE FROM tasks WHERE tasklist = 0 AND taskid = ANY(%(taskids)s)
+            RETURNING taskno, pkgbase, tasklist, info, repo, taskid, logid
+        )
+        INSERT INTO tasks_history (taskno, pkgbase, tasklist, info, repo, taskid, logid, finished)
+        SELECT t.taskno, t.pkgbase, t.tasklist, t.info, t.repo, t.taskid, t.logid, {finished}
+        FROM t LEFT JOIN all_logs l ON l.id = t.logid
+    """, params)
+    return cursor.rowcount
+
+
+def archive_logs(cursor, days, now):
+    """Moves the logs older than days, returns how many."""
+    cursor.execute("SELECT DISTINCT date_trunc('month', build_time) FROM logs "
+                   "WHERE build_time < %s::timestamp - make_interval(days => %s)", (now, days))
+    ensure_partitions(cursor, "logs_history", [row[0] for row in cursor.fetchall()])
+    cursor.execute("""
+        WITH l AS (
+            DELETE FROM logs WHERE build_time < %s::timestamp - make_interval(days => %s)
+            RETURNING id, pkgbase, builder, build_result, build_time, duration
+        )
+        INSERT INTO logs_history (id, pkgbase, builder, build_result, build_time, duration)
+        SELECT id, pkgbase, builder, build_result, build_time, duration FROM l
+    """, (now, days))
+    return cursor.rowcount
+
+
+def partitions(cursor):
+    """(name, table, month) of every history partition."""
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = ANY(%s)
+    """, (HISTORY_TABLES,))
+    result = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_RE.match(name)
+        if match:
+            result.append((name, match.group(1), datetime(int(match.group(2)), int(match.group(3)), 1)))
+    return sorted(result)
+
+
+def export(db_manager, directory, months, now):
+    """Dumps the partitions older than months to directory and drops them, returns their names."""
+    os.makedirs(directory, exist_ok=True)
+    cutoff = datetime(now.year, now.month, 1)
+    for _ in range(months):
+        cutoff = cutoff.replace(year=cutoff.year - (cutoff.month == 1), month=(cutoff.month - 2) % 12 + 1)
+
+    with db_manager.transaction() as cursor:
+        old = [name for name, _, month in partitions(cursor) if month < cutoff]
+    for name in old:
+        path = os.path.join(directory, f"{name}.csv.gz")
+        with db_manager.transaction() as cursor:
+            with gzip.open(path + ".tmp", "wt") as f:
+                cursor.copy_expert(f"COPY {name} TO STDOUT WITH CSV HEADER", f)
+            os.replace(path + ".tmp", path)
+            # Dropped in the same transaction, after the file is complete
+            cursor.execute(f"DROP TABLE {name}")
+        print(f"Exported {name} to {path}")
+    return old
+
+
+def restore(db_manager, path):
+    match = PARTITION_RE.match(os.path.basename(path).removesuffix(".csv.gz"))
+    if not match:
+        raise ValueError(f"{path} is not named like an exported partition")
+    table, month = match.group(1), datetime(int(match.group(2)), int(match.group(3)), 1)
+    with db_manager.transaction() as cursor:
+        ensure_partitions(cursor, table, [month])
+        with gzip.open(path, "rt") as f:
+            columns = f.readline().strip()
+            cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH CSV", f)
+        print(f"Restored {cursor.rowcount} rows of {table} for {month:%Y-%m}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old logs and finished tasks to the history tables.")
+    parser.add_argument("-d", "--days", type=int, default=LOG_DAYS, help="Keep logs of this many days live")
+    parser.add_argument("-k", "--keep", type=int, default=KEEP_LISTS, help="Keep this many latest task lists live")
+    parser.add_argument("--export", type=str, help="Dump old history partitions to this directory and drop them")
+    parser.add_argument("-m", "--export-months", type=int, default=EXPORT_MONTHS,
+                        help="With --export, partitions older than this many months")
+    parser.add_argument("--restore", type=str, nargs="+", help="Load exported partition files back")
+    args = parser.parse_args()
+    # insert_task numbers new lists from the newest one left in tasks
+    if args.keep < 1:
+        parser.error("--keep must be at least 1")
+
+    now = datetime.now()
+    with dbcmd.DatabaseManager() as db_manager:
+        if args.restore:
+            for path in args.restore:
+                try:
+                    restore(db_manager, path)
+                except ValueError as e:
+                    print(f"Error: {e}", file=sys.stderr)
+            return
+
+        start = time.perf_counter()
+        # Tasks first: they are filed under the time of their logs
+        with db_manager.transaction() as cursor:
+            tasks = archive_tasks(cursor, args.keep, now)
+        with db_manager.transaction() as cursor:
+            logs = archive_logs(cursor, args.days, now)
+        print(f"Moved {tasks} tasks and {logs} logs to history in {time.perf_counter() - start:.1f}s")
+
+        if args.export:
+            export(db_manager, args.export, args.export_months, now)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the scripts, on synthetic fixtures of Arch's size.
+
+    bench.py generate DIR     # sync dbs, files/links tarballs and build logs
+    bench.py run DIR -o a.json
+    bench.py compare a.json b.json
+
+DIR is laid out like a home directory (.cache/compare86/{x86,loong}/sync),
+so compare86, dbinit and genrebuild read it as they would the real cache.
+`run` creates a throwaway database next to the one in ~/.dbconfig.json,
+loads init.sql and the migrations into it, and drops it when done.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tarfile
+import time
+from datetime import datetime, timezone
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+INIT_SQL = os.path.join(SCRIPTS, "..", "loong-status", "init.sql")
+
+REPOS = ['core', 'extra', 'core-testing', 'extra-testing', 'core-staging', 'extra-staging']
+CORE_SHARE = 0.02
+BUILDERS = ["loong1", "loong2", "loong3"]
+
+# ANSI markers the same way makepkg and devtools print them
+MSG = "\x1b[1;32m==>\x1b[m\x1b[1m {}\x1b[m"
+ERROR = "\x1b[1;31m==> ERROR:\x1b[m\x1b[1m {}\x1b[m"
+WARNING = "\x1b[01m\x1b[K{}:{}:{}:\x1b[m\x1b[K \x1b[01;35m\x1b[Kwarning: \x1b[m\x1b[Kunused variable '{}'"
+
+
+class Base:
+    def __init__(self, idx, rng):
+        self.name = f"pkg{idx:05d}"
+        self.version = f"{rng.randint(0, 30)}.{rng.randint(0, 99)}-{rng.randint(1, 5)}"
+        self.names = [self.name] + [f"{self.name}-{s}" for s in ("docs", "libs", "tools")[:rng.choice((0, 0, 0, 1, 2, 3))]]
+        self.soname = f"lib{self.name}.so"
+        self.depends = []
+        self.makedepends = []
+        self.checkdepends = []
+
+
+def make_graph(count, rng):
+    """Bases with deep runtime chains, sonames and a few make/check cycles."""
+    bases = [Base(i, rng) for i in range(count)]
+    for i, base in enumerate(bases[1:], 1):
+        for _ in range(rng.randint(1, 6)):
+            if rng.random() < 0.3:
+                # Close to the previous ones: builds long chains
+                dep = bases[rng.randint(max(0, i - 50), i - 1)]
+            else:
+                # Mostly the low level packages
+                dep = bases[int(i * rng.random() ** 3)]
+            if rng.random() < 0.3:
+                base.depends.append(f"{dep.soname}=1-64")
+            else:
+                base.depends.append(dep.name)
+        for _ in range(rng.randint(0, 4)):
+            base.makedepends.append(bases[rng.randint(0, i - 1)].name)
+        # Back edges make the cycles genrebuild has to break
+        if rng.random() < 0.01 and i + 1 < count:
+            later = bases[rng.randint(i + 1, min(count - 1, i + 200))]
+            (base.checkdepends if rng.random() < 0.5 else base.makedepends).append(later.name)
+    return bases
+
+
+def desc(name, base, version, arch, fields):
+    lines = [
+        "%FILENAME%", f"{name}-{version}-{arch}.pkg.tar.zst", "",
+        "%NAME%", name, "",
+        "%BASE%", base, "",
+        "%VERSION%", version, "",
+        "%DESC%", f"Synthetic package {name}", "",
+        "%CSIZE%", str(len(name) * 4096), "",
+        "%ISIZE%", str(len(name) * 16384), "",
+        "%ARCH%", arch, "",
+        "%BUILDDATE%", str(1700000000 + len(name) * 1000), "",
+    ]
+    for key, values in fields:
+        if values:
+            lines += [f"%{key}%", *values, ""]
+    return "\n".join(lines) + "\n"
+
+
+def add_file(tar, path, data):
+    data = data.encode()
+    info = tarfile.TarInfo(path)
+    info.size = len(data)
+    info.mtime = 1700000000
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_repo(path, repo, entries, arch):
+    """Writes repo.db, repo.files and, for loong, repo.links.tar.gz."""
+    sync = os.path.join(path, "sync")
+    os.makedirs(sync, exist_ok=True)
+    with contextlib.ExitStack() as stack:
+        db = stack.enter_context(tarfile.open(os.path.join(sync, f"{repo}.db"), "w:gz"))
+        files = stack.enter_context(tarfile.open(os.path.join(sync, f"{repo}.files"), "w:gz"))
+        links = None
+        if arch != "x86_64":
+            links = stack.enter_context(tarfile.open(os.path.join(sync, f"{repo}.links.tar.gz"), "w:gz"))
+        for base, version in entries:
+            for name in base.names:
+                fields = [
+                    ("PROVIDES", [f"{base.soname}=1-64"] if name == base.name else []),
+                    ("DEPENDS", base.depends if name == base.name else [f"{base.name}={version}"]),
+                    ("MAKEDEPENDS", base.makedepends),
+                    ("CHECKDEPENDS", base.checkdepends),
+                ]
+                text = desc(name, base.name, version, arch, fields)
+                add_file(db, f"{name}-{version}/desc", text)
+                add_file(files, f"{name}-{version}/desc", text)
+                filelist = ["usr/", "usr/bin/", f"usr/bin/{name}", "usr/lib/", f"usr/lib/{base.soname}.1",
+                            f"usr/share/doc/{name}/"] + [f"usr/share/doc/{name}/page{i}.html" for i in range(14)]
+                add_file(files, f"{name}-{version}/files", "%FILES%\n" + "\n".join(filelist) + "\n")
+                if links is not None:
+                    linked = [f"usr/lib/lib{d.split('=')[0][3:]}.1" for d in base.depends if d.startswith("lib")]
+                    add_file(links, f"{name}-{version}/links", "\n".join(linked) + "\n")
+
+
+def bump(version, rng):
+    pkgver, pkgrel = version.rsplit("-", 1)
+    return f"{pkgver}.{rng.randint(1, 9)}-{pkgrel}"
+
+
+def loong_version(version, rng):
+    """Mostly the same as x86, some with a point pkgrel, some outdated or missing."""
+    roll = rng.random()
+    if roll < 0.05:
+        return None
+    if roll < 0.12:
+        pkgver, pkgrel = version.rsplit("-", 1)
+        return f"{pkgver}-{int(pkgrel) - 1}" if int(pkgrel) > 1 else f"0.{pkgver}-{pkgrel}"
+    if roll < 0.3:
+        return f"{version}.1"
+    return version
+
+
+def write_log(path, base, size, rng):
+    """A build log of about size bytes, ending in success or a build() failure."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    failed = rng.random() < 0.2
+    with open(path, "w") as f:
+        f.write(MSG.format(f"Making package: {base.name} {base.version} (Thu Jan  1 00:00:00 2026)") + "\n")
+        f.write(MSG.format("Building in chroot for [extra] (x86_64)...") + "\n")
+        if rng.random() < 0.3:
+            f.write(MSG.format("Loong's patch applied.") + "\n")
+        written = 0
+        while written < size:
+            if rng.random() < 0.05:
+                line = WARNING.format(f"src/mod{rng.randint(0, 99)}/file{rng.randint(0, 999)}.c",
+                                      rng.randint(1, 2000), rng.randint(1, 80), "tmp")
+            else:
+                line = f"  CC       src/mod{rng.randint(0, 99)}/file{rng.randint(0, 999)}.o"
+            f.write(line + "\n")
+            written += len(line) + 1
+        if failed:
+            f.write(ERROR.format("A failure occurred in build().") + "\n")
+            f.write(f"failed on {rng.choice(BUILDERS)}, time cost: {rng.randint(60, 20000)}\n")
+        else:
+            f.write(MSG.format(f"Finished making: {base.name} {base.version} (Thu Jan  1 01:00:00 2026)") + "\n")
+            f.write(f"built on {rng.choice(BUILDERS)}, time cost: {rng.randint(60, 20000)}\n")
+
+
+def generate(directory, packages, log_mb, logs, seed):
+    rng = random.Random(seed)
+    bases = make_graph(packages, rng)
+    cache = os.path.join(directory, ".cache", "compare86")
+    ncore = max(1, int(len(bases) * CORE_SHARE))
+
+    x86 = {repo: [] for repo in REPOS}
+    loong = {repo: [] for repo in REPOS}
+    for i, base in enumerate(bases):
+        stable = "core" if i < ncore else "extra"
+        x86[stable].append((base, base.version))
+        ver = loong_version(base.version, rng)
+        if ver:
+            loong[stable].append((base, ver))
+        roll = rng.random()
+        if roll < 0.02:
+            x86[f"{stable}-testing"].append((base, bump(base.version, rng)))
+            if rng.random() < 0.5:
+                loong[f"{stable}-testing"].append((base, bump(base.version, rng)))
+        elif roll < 0.03:
+            x86[f"{stable}-staging"].append((base, bump(base.version, rng)))
+
+    for repo in REPOS:
+        write_repo(os.path.join(cache, "x86"), repo, x86[repo], "x86_64")
+        write_repo(os.path.join(cache, "loong"), repo, loong[repo], "loong64")
+
+    # A few big logs and many small ones, like the real build_logs
+    total = log_mb * 1024 * 1024
+    picked = rng.sample(bases, min(logs, len(bases)))
+    weights = [rng.paretovariate(1.2) for _ in picked]
+    scale = total / sum(weights)
+    for base, weight in zip(picked, weights):
+        write_log(os.path.join(directory, "build_logs", base.name, "all.log"), base, int(weight * scale), rng)
+
+    with open(os.path.join(directory, "fixture.json"), "w") as f:
+        json.dump({"packages": packages, "log_mb": log_mb, "logs": logs, "seed": seed,
+                   "roots": [b.name for b in bases[:3]]}, f)
+    print(f"Generated {sum(len(b.names) for b in bases)} packages of {len(bases)} bases "
+          f"and {len(picked)} logs ({log_mb} MiB) in {directory}")
+
+
+def measure(func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {"best": min(timings), "median": statistics.median(timings), "runs": runs}
+
+
+class ThrowawayDatabase:
+    """A database created from the admin config for the run, dropped afterwards."""
+
+    def __init__(self, admin_config, home):
+        import psycopg2
+        with open(admin_config, 'r') as f:
+            self.config = json.load(f)
+        self.name = f"{self.config['database']['name']}_bench_{os.getpid()}"
+        self.config_file = os.path.join(home, ".dbconfig.json")
+        self.admin = psycopg2.connect(
+            dbname=self.config['database']['name'],
+            user=self.config['database']['user'],
+            password=self.config['database']['password'],
+            host=self.config['database']['host']
+        )
+        self.admin.autocommit = True
+
+    def __enter__(self):
+        with self.admin.cursor() as cursor:
+            cursor.execute(f'CREATE DATABASE "{self.name}"')
+        config = dict(self.config, database=dict(self.config['database'], name=self.name))
+        with open(self.config_file, 'w') as f:
+            json.dump(config, f)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self.admin.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS "{self.name}" WITH (FORCE)')
+        self.admin.close()
+        os.remove(self.config_file)
+
+
+def run(directory, output, runs, admin_config):
+    with open(os.path.join(directory, "fixture.json"), "r") as f:
+        fixture = json.load(f)
+    # compare86, dbinit and genrebuild find the fixtures and the throwaway
+    # database through $HOME
+    os.environ["HOME"] = directory
+    sys.path.insert(0, SCRIPTS)
+    import compare86
+    import dbcmd
+    import dbinit
+    import dbmigrate
+    import parselog
+
+    results = {}
+
+    def compare_repos():
+        for repo in ("core", "extra"):
+            x86_db = compare86.load_repo(os.path.join(compare86.cache_dir, "x86"), repo)
+            loong_db = compare86.load_repo(os.path.join(compare86.cache_dir, "loong"), repo)
+            compare86.compare_repos(x86_db, loong_db, False, False, repo)
+        compare86.pkglist.clear()
+    results["compare_repos"] = measure(compare_repos, runs)
+
+    def safe_tobuild():
+        compare86.safe_tobuild()
+        compare86.pkglist.clear()
+    results["safe_tobuild"] = measure(safe_tobuild, runs)
+
+    logs = [os.path.join(root, name) for root, _, names in os.walk(os.path.join(directory, "build_logs"))
+            for name in names]
+    log_bytes = sum(os.path.getsize(log) for log in logs)
+    results["parse_build_log"] = measure(lambda: [parselog.parse_build_log(log) for log in logs], runs)
+    results["parse_build_log"]["mib_per_s"] = log_bytes / 1024 / 1024 / results["parse_build_log"]["best"]
+
+    with ThrowawayDatabase(admin_config, directory):
+        with dbcmd.DatabaseManager() as db_manager:
+            with db_manager.transaction() as cursor:
+                with open(INIT_SQL, 'r') as f:
+                    cursor.execute(f.read())
+                cursor.execute("INSERT INTO last_update VALUES ('')")
+            dbmigrate.migrate(db_manager)
+
+            results["fetch_all_packages"] = measure(lambda: dbinit.fetch_all_packages(db_manager), runs)
+
+            rng = random.Random(fixture["seed"])
+            with db_manager.transaction() as cursor:
+                cursor.execute("SELECT DISTINCT base FROM packages")
+                bases = [row[0] for row in cursor.fetchall()]
+                cursor.executemany("INSERT INTO timecost (base, estimate, samples) VALUES (%s, %s, 1)",
+                                   [(base, rng.randint(60, 20000)) for base in bases])
+
+        genrebuild = [sys.executable, os.path.join(SCRIPTS, "genrebuild"), "--dbpath", os.path.join(compare86.cache_dir, "x86"),
+                      "-d", "core,extra", "-e", "-m", "--timecost", *fixture["roots"]]
+        results["genrebuild"] = measure(
+            lambda: subprocess.run(genrebuild, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL), runs)
+
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "fixture": fixture,
+        },
+        "results": results,
+    }
+    print_results(results)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=1)
+            f.write("\n")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "-C", SCRIPTS, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results):
+    for name, res in results.items():
+        extra = f"  {res['mib_per_s']:.1f} MiB/s" if "mib_per_s" in res else ""
+        print(f"{name:20} {res['best']:10.3f}s best {res['median']:10.3f}s median{extra}")
+
+
+def compare(before_file, after_file):
+    with open(before_file, 'r') as f:
+        before = json.load(f)
+    with open(after_file, 'r') as f:
+        after = json.load(f)
+    if before["meta"]["fixture"] != after["meta"]["fixture"]:
+        print("Warning: the results come from different fixtures", file=sys.stderr)
+    print(f"{'benchmark':20} {before['meta']['commit']:>10} {after['meta']['commit']:>10}  change")
+    for name, res in after["results"].items():
+        if name not in before["results"]:
+            print(f"{name:20} {'-':>10} {res['best']:9.3f}s")
+            continue
+        old = before["results"][name]["best"]
+        print(f"{name:20} {old:9.3f}s {res['best']:9.3f}s  {(res['best'] - old) / old * 100:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scripts on synthetic fixtures.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    gen = subparsers.add_parser("generate", help="Generate the fixtures")
+    gen.add_argument("directory", help="Fixture directory")
+    gen.add_argument("-p", "--packages", type=int, default=15000, help="Number of package bases")
+    gen.add_argument("-l", "--log-mb", type=int, default=256, help="Total size of the build logs in MiB")
+    gen.add_argument("-n", "--logs", type=int, default=500, help="Number of build logs")
+    gen.add_argument("-s", "--seed", type=int, default=1, help="Random seed")
+
+    run_parser = subparsers.add_parser("run", help="Time each subsystem on the fixtures")
+    run_parser.add_argument("directory", help="Fixture directory")
+    run_parser.add_argument("-o", "--output", type=str, help="Save the results as JSON")
+    run_parser.add_argument("-r", "--runs", type=int, default=3, help="Runs of each benchmark")
+    run_parser.add_argument("-c", "--config", default=os.path.join(os.path.expanduser('~'), '.dbconfig.json'),
+                            help="Database config used to create the throwaway database")
+
+    cmp_parser = subparsers.add_parser("compare", help="Compare two results")
+    cmp_parser.add_argument("before")
+    cmp_parser.add_argument("after")
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate(os.path.abspath(args.directory), args.packages, args.log_mb, args.logs, args.seed)
+    elif args.command == "run":
+        run(os.path.abspath(args.directory), args.output, args.runs, args.config)
+    elif args.command == "compare":
+        compare(args.before, args.after)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
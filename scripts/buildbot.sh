@@ -6,6 +6,8 @@ SCRIPTSPATH=${SCRIPTSPATH:=$HOME/loongshot/scripts}
 BUILDER=${BUILDER:=loong1}
 BUILDDIR=${BUILDDIR:=/mnt/repos}
 BUILDLIST=${BUILDLIST:="1"}
+WAITTASK=${WAITTASK:=""}  # set to keep running and wait for new tasks instead of exiting
+DISPATCH=${DISPATCH:=""}  # set to pick the queued tasks that best fit $BUILDER
 
 max_retries=3
 max_size=102400  # if the build fails quick ( with small size ), try to recovery
@@ -27,7 +29,7 @@ umask 002
 while [ 1 ]; do
     retries=0
 
-    pkg=`$SCRIPTSPATH/dbcmd.py task --get --build --list $BUILDLIST`
+    pkg=`$SCRIPTSPATH/dbcmd.py task --get --build ${WAITTASK:+--wait} ${DISPATCH:+--builder $BUILDER} --list $BUILDLIST`
     orig=$pkg
 
     if [[ "$pkg" == None ]]; then
@@ -63,39 +65,22 @@ while [ 1 ]; do
             ALLLOGS=$ZSTLOGDIR/$pkg/$pkg-$PKGVER.log
         fi
 
-        if [ $(stat -c %s "$ALLLOGS") -lt $max_size ]; then
-
-            # restart to download the corrupted packages
-            grep "pkg.tar.zst is corrupted" $ALLLOGS >/dev/null 2>&1 && continue
-
-            # update config.{sub,guess} and retry
-            grep -q "unable to guess system type" $ALLLOGS && echo $pkg >> ~/loongarch-packages/update_config && continue
-
-            # re-download failed files
-            if grep -q "One or more files did not pass the validity check" $ALLLOGS; then
-                for failed in `awk '/Validating source files with/{flag=1; next} /One or more files did not pass the validity check/{flag=0} flag && /FAILED/ {print $1}' "$ALLLOGS"`; do
-                    ssh $BUILDER -t "rm $BUILDDIR/$pkg/$failed -rf"
-                done
+        DECISION=$($SCRIPTSPATH/buildretry.py --pkgbase $pkg --builddir $BUILDDIR --max-size $max_size "$ALLLOGS")
+        [[ $(jq -r .update_config <<< "$DECISION") == true ]] && echo $pkg >> ~/loongarch-packages/update_config
+        case $(jq -r .action <<< "$DECISION") in
+            retry)
                 continue
-            fi
-
-            if grep -q "Could not download sources." $ALLLOGS; then
-                if grep -q "server does not seem to support byte ranges" $ALLLOGS; then
-                    ssh $BUILDER -t "rm $BUILDDIR/$pkg/*.part -f"
-                    continue
-                fi
-                for failed in `awk '/is not a clone/ && $3 ~ /^\/mnt\/repos\//  {print $3}' "$ALLLOGS"`; do
-                    # remove bad repo
-                    ssh $BUILDER -t "rm $failed -rf"
-                done
+                ;;
+            backoff)
+                sleep $(jq -r .delay <<< "$DECISION")
                 continue
-            fi
-
-            if grep -q -e "remote: GitLab is not responding" -e "Resolving timed out after 10000 milliseconds" -e "Connection timed out after 10001 milliseconds" -e "fatal: unable to access 'https://gitlab.archlinux.org"  $ALLLOGS; then
-                sleep 100
+                ;;
+            clean)
+                CLEAN=$(jq -r '.clean | join(" ")' <<< "$DECISION")
+                [[ -n "$CLEAN" ]] && ssh $BUILDER -t "rm -rf $CLEAN"
                 continue
-            fi
-        fi
+                ;;
+        esac
         break
     done
 
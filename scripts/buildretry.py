@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Decides whether buildbot.sh should retry a failed build, from a single pass
+over its log. Prints the decision as JSON:
+
+    {"action": "retry" | "backoff" | "clean" | "giveup",
+     "delay": seconds to sleep before retrying,
+     "clean": paths to remove on the builder before retrying,
+     "update_config": whether to add the package to update_config,
+     "stage": error code from parselog.ERROR_PATTERNS,
+     "reason": what matched}
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from parselog import ERROR_PATTERNS
+
+# Only logs smaller than this are looked at; a big log means the build
+# really ran and failed (or succeeded), so retrying won't help.
+MAX_SIZE = 102400
+BACKOFF_DELAY = 100
+
+# Same layout as parselog's tables: (key, regex)
+RETRY_PATTERNS = [
+    ("corrupted",    r"pkg\.tar\.zst is corrupted"),
+    ("guess",        r"unable to guess system type"),
+    ("validating",   r"Validating source files with"),
+    ("validity",     r"One or more files did not pass the validity check"),
+    ("download",     r"Could not download sources\."),
+    ("byteranges",   r"server does not seem to support byte ranges"),
+    ("notclone",     r"is not a clone"),
+    ("gitlab",       r"remote: GitLab is not responding"
+                     r"|Resolving timed out after 10000 milliseconds"
+                     r"|Connection timed out after 10001 milliseconds"
+                     r"|fatal: unable to access 'https://gitlab\.archlinux\.org"),
+]
+
+RETRY_RE = [(key, re.compile(pattern)) for key, pattern in RETRY_PATTERNS]
+ERROR_RE = [(idx, re.compile(pattern)) for idx, pattern in ERROR_PATTERNS]
+
+
+def scan_log(log_path, builddir):
+    """Reads the log once and returns what matched, with the files to clean."""
+    found = set()
+    failed_sources = []
+    bad_clones = []
+    stage = 0
+    validating = False
+
+    with open(log_path, 'r', errors="ignore") as log_file:
+        for line in log_file:
+            for key, pattern in RETRY_RE:
+                if pattern.search(line):
+                    found.add(key)
+                    if key == "validating":
+                        validating = True
+                    elif key == "validity":
+                        validating = False
+                    elif key == "notclone":
+                        fields = line.split()
+                        if len(fields) > 2 and fields[2].startswith(builddir + "/"):
+                            bad_clones.append(fields[2])
+            if validating and "FAILED" in line:
+                failed_sources.append(line.split()[0])
+            for idx, pattern in ERROR_RE:
+                if pattern.search(line):
+                    stage = idx
+
+    return found, failed_sources, bad_clones, stage
+
+
+def classify_log(log_path, pkgbase, builddir, max_size=MAX_SIZE):
+    decision = {"action": "giveup", "delay": 0, "clean": [], "update_config": False, "stage": 0, "reason": ""}
+    try:
+        if os.path.getsize(log_path) >= max_size:
+            decision["reason"] = "log too large to be a transient failure"
+            return decision
+        found, failed_sources, bad_clones, stage = scan_log(log_path, builddir)
+    except OSError as e:
+        decision["reason"] = f"cannot read log: {e}"
+        return decision
+
+    decision["stage"] = stage
+    pkgdir = os.path.join(builddir, pkgbase)
+
+    # restart to download the corrupted packages
+    if "corrupted" in found:
+        decision.update(action="retry", reason="corrupted package")
+    # update config.{sub,guess} and retry
+    elif "guess" in found:
+        decision.update(action="retry", update_config=True, reason="unable to guess system type")
+    # re-download failed files
+    elif "validity" in found:
+        decision.update(action="clean", clean=[os.path.join(pkgdir, f) for f in failed_sources],
+                        reason="source validity check failed")
+    elif "download" in found:
+        if "byteranges" in found:
+            decision.update(action="clean", clean=[os.path.join(pkgdir, "*.part")],
+                            reason="server does not support byte ranges")
+        else:
+            # remove bad repo
+            decision.update(action="clean", clean=bad_clones, reason="could not download sources")
+    elif "gitlab" in found:
+        decision.update(action="backoff", delay=BACKOFF_DELAY, reason="gitlab not responding")
+    return decision
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify a failed build log into a retry decision.")
+    parser.add_argument("log", help="Build log to classify")
+    parser.add_argument("-p", "--pkgbase", required=True, help="Package being built")
+    parser.add_argument("-d", "--builddir", default="/mnt/repos", help="Work directory on the builder")
+    parser.add_argument("--max-size", type=int, default=MAX_SIZE, help="Logs this big are never retried")
+    args = parser.parse_args()
+
+    decision = classify_log(args.log, args.pkgbase, args.builddir.rstrip("/"), args.max_size)
+    print(json.dumps(decision))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -68,7 +68,7 @@ if [[ -z "$RESUME" ]]; then
     fi
     echo $PKG | tr ' ' '\n' > today.lst
     echo "Start to ordering..."
-    PKG=$(timeout 20 ./genrebuild --dbpath ~/.cache/compare86/x86 `echo $PKG` | tr ' ' ',')
+    PKG=$(timeout 20 ./genrebuild --timecost --dbpath ~/.cache/compare86/x86 `echo $PKG` | tr ' ' ',')
     if [[ ! -z "$SAVE" ]]; then
         echo $PKG
         exit 1
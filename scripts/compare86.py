@@ -2,9 +2,12 @@
 import argparse
 import json
 import os
+import perfstat
 import pyalpm
 import sys
-from collections import deque
+import syncdb
+import tempfile
+from collections import defaultdict, deque
 from datetime import datetime
 from pathlib import Path
 from pydantic import BaseModel
@@ -18,6 +21,8 @@ cache_dir = os.path.join(home_dir, ".cache", "compare86")
 x86_repo_path = "x86"
 loong64_repo_path = "loong"
 source_repos = ['core', 'extra']
+query_repos = ["core", "extra", "core-staging", "extra-staging", "core-testing", "extra-testing"]
+query_cache = os.path.join(cache_dir, "query.json")
 
 pkgtime = {}
 # Store package info
@@ -43,6 +48,7 @@ def load_config(config_file=None):
         raise
 
 # cache all package buildtime
+@perfstat.timed()
 def get_builddate():
     for repo in source_repos:
         x86_db = load_repo(os.path.join(cache_dir, x86_repo_path), repo)
@@ -50,6 +56,7 @@ def get_builddate():
             pkgtime[pkg.base] = pkg.builddate
 
 
+@perfstat.timed()
 def update_repo(mirror_x86, mirror_loong64):
     for repo in source_repos:
         db = load_repo(f"{cache_dir}/{x86_repo_path}", repo)
@@ -72,57 +79,107 @@ def load_repo(repo_path, repo):
         return None
 
 
+class ProvideIndex:
+    """Names and versioned provides of the packages of several dbs."""
+
+    def __init__(self):
+        self.pkgs = {}
+        self.entries = defaultdict(list)
+
+    def add_db(self, db):
+        for pkg in db.pkgcache:
+            key = (db.name, pkg.name)
+            self.pkgs[key] = pkg
+            self.entries[pkg.name].append((pkg.version, key))
+            for provide in pkg.provides:
+                name, _, version = provide.partition("=")
+                self.entries[name].append((version or None, key))
+
+    def satisfiers(self, depend):
+        """Keys of all packages satisfying a depend string."""
+        name, op, want = syncdb.parse_depend(depend)
+        # An unversioned provide only satisfies an unversioned depend
+        return {key for version, key in self.entries.get(name, ())
+                if op is None or (version is not None and syncdb.version_satisfies(version, op, want))}
+
+
+def broken_packages(index):
+    """Packages whose runtime depends can't be installed from the index, transitively."""
+    depends = {key: [index.satisfiers(dep) for dep in pkg.depends] for key, pkg in index.pkgs.items()}
+    broken = set()
+    changed = True
+    while changed:
+        changed = False
+        for key, sats in depends.items():
+            if key not in broken and not all(sat - broken for sat in sats):
+                broken.add(key)
+                changed = True
+    return broken
+
+
 # Find packages with all depends satisfied
+@perfstat.timed()
 def safe_tobuild():
-    x86 = {}
-    x86_repo = {}
-    for repo in source_repos:
-        x86_db = load_repo(os.path.join(cache_dir, x86_repo_path), repo)
-        for pkg in x86_db.pkgcache:
-            alldep = pkg.makedepends + pkg.checkdepends + pkg.depends
-            alldep = {dep.split("=")[0].split(">")[0].split("<")[0] for dep in alldep}
-            if (not pkg.base in x86):
-                x86[pkg.base] = set()
-            x86[pkg.base] |= alldep
-            x86_repo[pkg.base] = PackageMetadata(
-                name=pkg.base,
-                base=pkg.base,
-                x86_version=pkg.version,
-                repo=repo
-            )
-            # f"{pkg.version:24} {repo}"
-
-    loong = {}
+    """
+    Missing and outdated packages whose whole dependency closure is already
+    installable on loong, most wanted first: ranked by how many other queued
+    packages are waiting on them.
+    """
+    x86 = ProvideIndex()
     for repo in source_repos:
-        loong_db = load_repo(os.path.join(cache_dir, loong64_repo_path), repo)
-        loong_pkg = {pkg.base: pkg.version for pkg in loong_db.pkgcache}
-        loong = {**loong, **loong_pkg}
+        x86.add_db(load_repo(os.path.join(cache_dir, x86_repo_path), repo))
 
     # For -testing or -staging repo, also check dependency from stable repo
     dep_repos = [*source_repos, 'core', 'extra'] if source_repos[0].find('-') > 0 else source_repos
-    loong_stable = {}
+    loong = ProvideIndex()
+    loong_ver = {}
     for repo in dep_repos:
         loong_db = load_repo(os.path.join(cache_dir, loong64_repo_path), repo)
-        loong_pkg = {pkg.name: pkg.version for pkg in loong_db.pkgcache}
-        for pkg in loong_db.pkgcache:
-            for provide in pkg.provides:
-                provide = provide.split("=")[0].split(">")[0].split("<")[0]
-                loong_pkg[provide] = pkg.version
-        loong_stable = {**loong_stable, **loong_pkg}
+        loong.add_db(loong_db)
+        if repo in source_repos:
+            for pkg in loong_db.pkgcache:
+                loong_ver.setdefault(pkg.base, pkg.version)
+    broken = broken_packages(loong)
+
+    bases = defaultdict(list)
+    for key, pkg in x86.pkgs.items():
+        bases[pkg.base].append(key)
+    queued = {base for base, keys in bases.items()
+              if base not in loong_ver or pyalpm.vercmp(loong_ver[base], x86.pkgs[keys[0]].version) < 0}
+
+    buildable = []
+    waiting = defaultdict(int)
+    for base in queued:
+        blockers = set()
+        missing = False
+        for key in bases[base]:
+            pkg = x86.pkgs[key]
+            for dep in pkg.makedepends + pkg.checkdepends + pkg.depends:
+                # Split packages of the same base come with the build
+                if x86.satisfiers(dep) & set(bases[base]):
+                    continue
+                if loong.satisfiers(dep) - broken:
+                    continue
+                missing = True
+                blockers |= {x86.pkgs[k].base for k in x86.satisfiers(dep)} & queued
+        if missing:
+            for blocker in blockers:
+                waiting[blocker] += 1
+        else:
+            buildable.append(base)
 
-    for pkg_name in x86:
-        if (not pkg_name in loong) and (all(pkg in loong_stable for pkg in x86[pkg_name])):
-            # print(f"{pkg_name:34} {x86_repo[pkg_name]}")
-            p = PackageMetadata(
-                name=f'{pkg_name}',
-                base=f'{pkg_name}',
-                x86_version=f'{x86_repo[pkg_name].x86_version}',
-                repo=f'{x86_repo[pkg_name].repo}'
-            )
-            pkglist.append(p)
+    for base in sorted(buildable, key=lambda b: (-waiting[b], b)):
+        pkglist.append(PackageMetadata(
+            name=base,
+            base=base,
+            x86_version=x86.pkgs[bases[base][0]].version,
+            loong64_version=loong_ver.get(base, 'missing'),
+            repo=bases[base][0][0]
+        ))
 
 
 # Check repo for errors
+@perfstat.timed()
 def loong_lint():
     loong = {}
     base2name = {}
@@ -138,6 +195,7 @@ def loong_lint():
 
 
 # Compare all packages in both repos
+@perfstat.timed()
 def compare_all():
     for repo in source_repos:
         x86 = {}
@@ -192,34 +250,53 @@ def show_reverse_depends(depend):
     for pkg in depends:
         print(pkg)
 
+@perfstat.timed()
 def move_repos(ignore_version=False):
+    """
+    Finds loong packages that sit in another repo than x86's copy, in one pass
+    over an index of x86. Returns the moves as {(from, to): [pkg, ...]}.
+    """
     x86 = {}
     for repo in source_repos:
         x86_db = load_repo(os.path.join(cache_dir, x86_repo_path), repo)
         for pkg in x86_db.pkgcache:
-            if pkg.name not in x86:  # Use pkgname this time
-                x86[pkg.name] = {}
-            x86[pkg.name][repo] = pkg.version  # Add the repo and version to the pkg.base entry
+            # Use pkgname this time
+            x86.setdefault(pkg.name, []).append((repo, pkg.version))
 
-    loong = {}
-    for repo in source_repos:
-        loong_db = load_repo(os.path.join(cache_dir, loong64_repo_path), repo)
-        for pkg in loong_db.pkgcache:
-            if pkg.name not in loong:
-                loong[pkg.name] = {}
-            loong[pkg.name][repo] = pkg.version
+    def same_version(loong_ver, x86_ver):
+        # A point pkgrel (1.0-1.1) is still the same build as 1.0-1
+        return ignore_version or loong_ver == x86_ver or loong_ver.startswith(x86_ver + ".")
 
-    for pkg_name in loong:
-        if pkg_name in x86:
-            for lrepo in loong[pkg_name]:
-                for xrepo in x86[pkg_name]:
-                    if (lrepo == xrepo):
-                        continue
-                    if loong[pkg_name][lrepo].startswith(x86[pkg_name][xrepo]) or ignore_version:
-                        print(f"{pkg_name}-{loong[pkg_name][lrepo]} {lrepo}->{xrepo}")
+    plan = {}
+    for lrepo in source_repos:
+        loong_db = load_repo(os.path.join(cache_dir, loong64_repo_path), lrepo)
+        for pkg in loong_db.pkgcache:
+            placed = x86.get(pkg.name)
+            if not placed:
+                continue
+            # Already where x86 has it
+            if any(xrepo == lrepo and same_version(pkg.version, xver) for xrepo, xver in placed):
+                continue
+            # source_repos lists stable repos first, so they win over testing or staging
+            target = next((xrepo for xrepo, xver in placed if same_version(pkg.version, xver)), None)
+            if target:
+                plan.setdefault((lrepo, target), []).append(pkg)
+                print(f"{pkg.name}-{pkg.version} {lrepo}->{target}")
+    return plan
+
+
+def write_plan(plan, file):
+    """Saves a move plan for move-repo.sh --plan, one entry per (from, to)."""
+    groups = [{"from": src, "to": dst,
+               "packages": [{"name": pkg.name, "version": pkg.version, "filename": pkg.filename} for pkg in pkgs]}
+              for (src, dst), pkgs in sorted(plan.items())]
+    with open(file, 'w') as f:
+        json.dump(groups, f, indent=1)
+        f.write('\n')
 
 
 # Compare the packages in one repos
+@perfstat.timed()
 def compare_repos(x86_db, loong64_db, showtime, show_newer=False, repo='missing'):
     get_builddate()
     time_now = datetime.now()
@@ -282,6 +359,78 @@ def show_group(group, repo):
     for p in allbase:
         print(p)
 
+def db_stamp():
+    """mtime and size of every sync db file, to tell when the query cache is stale."""
+    stamp = {}
+    for arch_path in (x86_repo_path, loong64_repo_path):
+        for repo in query_repos:
+            db_file = os.path.join(cache_dir, arch_path, "sync", f"{repo}.db")
+            try:
+                st = os.stat(db_file)
+                stamp[f"{arch_path}/{repo}"] = [st.st_mtime_ns, st.st_size]
+            except FileNotFoundError:
+                pass
+    return stamp
+
+
+@perfstat.timed()
+def load_query_index():
+    """{pkgname: {repo: version}} for x86 and loong, cached until a db changes."""
+    stamp = db_stamp()
+    try:
+        with open(query_cache, 'r') as f:
+            cache = json.load(f)
+        if cache["stamp"] == stamp:
+            return cache["x86"], cache["loong"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = {}
+    for arch_path in (x86_repo_path, loong64_repo_path):
+        versions = {}
+        for repo in query_repos:
+            db = load_repo(os.path.join(cache_dir, arch_path), repo)
+            if db is None:
+                continue
+            for pkg in db.pkgcache:
+                versions.setdefault(pkg.name, {})[repo] = pkg.version
+        index[arch_path] = versions
+
+    try:
+        # A file of its own, other builders may be writing the cache too
+        fd, tmp = tempfile.mkstemp(prefix=".query.", dir=os.path.dirname(query_cache))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"stamp": stamp, "x86": index[x86_repo_path], "loong": index[loong64_repo_path]}, f)
+            os.replace(tmp, query_cache)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    except OSError as e:
+        print(f"Failed to save cache {query_cache}: {e}", file=sys.stderr)
+    return index[x86_repo_path], index[loong64_repo_path]
+
+
+# Everything 0build.sh needs to know about one package
+def query_package(pkgname):
+    x86, loong = load_query_index()
+    x86_ver = x86.get(pkgname, {})
+    loong_ver = loong.get(pkgname, {})
+
+    version = next((x86_ver[r] for r in source_repos if r in x86_ver), None)
+    # Same pick as `-p | awk '{print $5}' | tail -1`: loong's repo wins over x86's
+    found = [r for r in source_repos if r in x86_ver] + [r for r in source_repos if r in loong_ver]
+    repo = found[-1].replace('-staging', '').replace('-testing', '') if found else None
+
+    return {
+        "name": pkgname,
+        "version": version,
+        "repo": repo,
+        "x86": x86_ver,
+        "loong": loong_ver,
+    }
+
+
 # Write packages to a json file
 def write_to_json(data, file):
     serializable = [pkg.dict() for pkg in data]
@@ -319,6 +468,7 @@ def main():
     parser.add_argument("-B", "--build", action="store_true", help="Find package to build.")
     parser.add_argument("-t", "--time", action="store_true", help="Show package freshness.")
     parser.add_argument("-p", "--package", type=str, help="Find package in dbs.")
+    parser.add_argument("-Q", "--query", type=str, help="Print x86 version, repo and loong versions of a package as JSON, from a cached index.")
     parser.add_argument("-g", "--group", type=str, help="list packages in group.")
     parser.add_argument("-s", "--stag", action="store_true", help="Consider staging db.")
     parser.add_argument("-T", "--test", action="store_true", help="Consider testing db.")
@@ -328,6 +478,7 @@ def main():
     parser.add_argument("-l", "--lint", action="store_true", help="Check for db errors.")
     parser.add_argument("-d", "--depend", type=str, help="List reverse depends.")
     parser.add_argument("-o", "--output", type=str, help="Save output to file.")
+    parser.add_argument("--plan", type=str, help="Save the moves of -m/-M as JSON for move-repo.sh --plan.")
     parser.add_argument("--mirror_x86", type=str, help="Mirror of x86.")
     parser.add_argument("--mirror_loong", type=str, help="Mirror of loong.")
 
@@ -347,6 +498,8 @@ def main():
     ]
     if args.output and not any(required_for_output):
         parser.error("The -o/--output option can only be used with other specific options")
+    if args.plan and not (args.move or args.movehard):
+        parser.error("The --plan option can only be used with -m/--move or -M/--movehard")
 
     if args.time is None:
         args.time = False
@@ -365,6 +518,10 @@ def main():
             source_repos = ["core", "extra", "core-staging", "extra-staging", "core-testing", "extra-testing"]
         update_repo(mirror_x86, mirror_loong64)
 
+    if args.query:
+        print(json.dumps(query_package(args.query)))
+        return
+
     if args.build:
         safe_tobuild()
 
@@ -377,7 +534,9 @@ def main():
 
     if args.move or args.movehard:
         source_repos = ["core", "extra", "core-staging", "extra-staging", "core-testing", "extra-testing"]
-        move_repos(args.movehard)
+        plan = move_repos(args.movehard)
+        if args.plan:
+            write_plan(plan, args.plan)
 
     if args.core:
         repo = source_repos[0]
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Build time estimates of packages, in seconds on a builder of time_scale 1.0.
+
+Every build is recorded in logs with its raw duration. Successful ones also
+update the estimate of the package in the timecost table: an exponentially
+weighted moving average of the duration times the builder's time_scale,
+where once a package has a few samples a new one counts at most CLIP times
+off the estimate, so one odd run only nudges it. Packages that were never
+built are guessed from their x86 installed size, at the median seconds per
+byte of the packages that were.
+
+Scheduling and ETA code reads the estimates with estimates().
+"""
+
+import argparse
+import sys
+
+# Weight of a new sample in the moving average
+ALPHA = 0.3
+# After MIN_SAMPLES samples, a new one is clipped to within CLIP times the estimate
+CLIP = 3.0
+MIN_SAMPLES = 3
+# Guesses when there is nothing to go by
+DEFAULT_COST = 600
+DEFAULT_RATE = 3600 / (100 << 20)
+MIN_COST = 60
+
+
+def record(cursor, base, seconds):
+    """Adds a successful build of seconds (already normalized) to the estimate of base, returns the new estimate."""
+    cursor.execute("""
+        INSERT INTO timecost (base, estimate, samples, updated) VALUES (%(base)s, %(sample)s, 1, now())
+        ON CONFLICT (base) DO UPDATE SET
+            estimate = timecost.estimate + %(alpha)s * (CASE
+                WHEN timecost.samples < %(min)s THEN %(sample)s
+                ELSE LEAST(GREATEST(%(sample)s, timecost.estimate / %(clip)s), timecost.estimate * %(clip)s)
+                END - timecost.estimate),
+            samples = timecost.samples + 1,
+            updated = now()
+        RETURNING estimate
+    """, {"base": base, "sample": float(seconds), "alpha": ALPHA, "min": MIN_SAMPLES, "clip": CLIP})
+    return cursor.fetchone()[0]
+
+
+def size_rate(cursor):
+    """Median seconds per byte of x86 installed size, and median estimate, over the packages with an estimate."""
+    cursor.execute("""
+        SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY c.estimate / s.size) FILTER (WHERE s.size > 0),
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY c.estimate)
+        FROM timecost c LEFT JOIN (SELECT base, sum(x86_size)::float8 AS size FROM packages GROUP BY base) s
+            ON s.base = c.base
+    """)
+    rate, median = cursor.fetchone()
+    return rate or DEFAULT_RATE, median or DEFAULT_COST
+
+
+def estimates(cursor, bases=None):
+    """
+    {base: estimated seconds at time_scale 1.0} for bases, or for every base
+    in packages if None. Pkgbases like 'base:opt' are looked up by base.
+    """
+    if bases is not None:
+        bases = {base.split(':')[0] for base in bases if not base.startswith('%')}
+        if not bases:
+            return {}
+    cursor.execute("""
+        SELECT b.base, c.estimate, s.size
+        FROM (SELECT DISTINCT base FROM packages WHERE base IS NOT NULL AND (%(all)s OR base = ANY(%(bases)s))
+              UNION SELECT unnest(%(bases)s::text[])) b
+        LEFT JOIN timecost c ON c.base = b.base
+        LEFT JOIN (SELECT base, sum(x86_size)::float8 AS size FROM packages
+                   WHERE %(all)s OR base = ANY(%(bases)s) GROUP BY base) s ON s.base = b.base
+    """, {"all": bases is None, "bases": sorted(bases or [])})
+    rows = cursor.fetchall()
+
+    result = {base: estimate for base, estimate, _ in rows if estimate is not None}
+    if len(result) < len(rows):
+        rate, median = size_rate(cursor)
+        for base, estimate, size in rows:
+            if estimate is None:
+                result[base] = max(MIN_COST, size * rate) if size else median
+    return result
+
+
+def rebuild(cursor):
+    """Recomputes every estimate from the build durations in logs."""
+    import dbcmd
+    cursor.execute("""
+        SELECT l.pkgbase, l.duration * COALESCE(b.time_scale, 1.0)
+        FROM all_logs l LEFT JOIN builder b ON b.id = l.builder
+        WHERE l.duration > 0 AND l.build_result & %s = 0
+        ORDER BY l.build_time, l.id
+    """, (int(dbcmd.PkgFlags.FAIL),))
+    samples = cursor.fetchall()
+    cursor.execute("DELETE FROM timecost WHERE base IN (SELECT DISTINCT pkgbase FROM all_logs WHERE duration > 0)")
+    for base, seconds in samples:
+        record(cursor, base, seconds)
+    return len(samples)
+
+
+def main():
+    import dbcmd
+    parser = argparse.ArgumentParser(description="Show or rebuild the build time estimates.")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute the estimates from the durations in logs")
+    parser.add_argument("pkgbase", nargs="*", help="Packages to show the estimate of")
+    args = parser.parse_args()
+
+    with dbcmd.DatabaseManager() as db_manager:
+        with db_manager.transaction() as cursor:
+            if args.rebuild:
+                print(f"Replayed {rebuild(cursor)} builds")
+            if args.pkgbase:
+                cursor.execute("SELECT base, samples FROM timecost WHERE base = ANY(%s)", (args.pkgbase,))
+                samples = dict(cursor.fetchall())
+                for base, estimate in sorted(estimates(cursor, args.pkgbase).items()):
+                    source = f"{samples[base]} builds" if base in samples else "guessed"
+                    print(f"{base:34} {estimate:10.0f}  {source}")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
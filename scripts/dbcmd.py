@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 
 import argparse
+import costmodel
 import psycopg2
 import json
 import os
+import perfstat
+import select
 import sys
+import time
 from enum import IntFlag
 from contextlib import contextmanager
 
@@ -46,8 +50,25 @@ ERROR_MESSAGES = [
     "A failure occurred in check",
     "A failure occurred in package",
     "configure: error: cannot guess build type;",
+    "Failure while publishing",
 ]
 
+# insert_task notifies this channel with the tasklist as payload
+TASK_CHANNEL = "tasks"
+
+# taskno is a sparse order key: appended tasks are TASK_GAP apart and
+# inserted ones split the gap, so inserting never renumbers the queue.
+# Rebalancing spreads a list out again when a gap is used up.
+TASK_GAP = 1024
+TASKNO_MAX = 2**31 - 1
+# Advisory lock class serializing inserts and rebalancing of one tasklist
+TASK_LOCK = 1
+
+# How many waiting tasks, from the head of the queue, a builder may choose from
+DISPATCH_WINDOW = 20
+# Seconds between reconnect attempts of get_task --wait after a database error
+WAIT_RETRY = 10
+
 
 class DatabaseManager:
     """Manages the raw database connection and transactions."""
@@ -60,21 +81,29 @@ class DatabaseManager:
         self.config_file = config_file
         self._connect()
 
+    def _open(self):
+        with open(self.config_file, 'r') as f:
+            config = json.load(f)
+
+        self.conn = psycopg2.connect(
+            dbname=config['database']['name'],
+            user=config['database']['user'],
+            password=config['database']['password'],
+            host=config['database']['host']
+        )
+
     def _connect(self):
         try:
-            with open(self.config_file, 'r') as f:
-                config = json.load(f)
-
-            self.conn = psycopg2.connect(
-                dbname=config['database']['name'],
-                user=config['database']['user'],
-                password=config['database']['password'],
-                host=config['database']['host']
-            )
+            self._open()
         except Exception as e:
             print(f"DB Init Error: {e}", file=sys.stderr)
             sys.exit(1)
 
+    def reconnect(self):
+        """Reopens the connection, raising instead of exiting if that fails."""
+        self.close()
+        self._open()
+
     def close(self):
         if self.conn:
             self.conn.close()
@@ -91,7 +120,11 @@ class DatabaseManager:
         if self.conn.closed:
             self._connect()
 
-        cursor = self.conn.cursor()
+        if perfstat.ENABLED:
+            start = time.perf_counter()
+            cursor = self.conn.cursor(cursor_factory=CountingCursor)
+        else:
+            cursor = self.conn.cursor()
         try:
             yield cursor
             self.conn.commit()
@@ -101,6 +134,16 @@ class DatabaseManager:
             raise e
         finally:
             cursor.close()
+            if perfstat.ENABLED:
+                perfstat.observe("db.transaction", time.perf_counter() - start)
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Cursor counting its queries for perfstat."""
+
+    def execute(self, query, vars=None):
+        perfstat.add("db.queries")
+        return super().execute(query, vars)
 
 # Bit/Flag Operations
 class BitManager:
@@ -118,26 +161,67 @@ class BitManager:
         except Exception:
             return -2
 
-    def update_bits(self, base, add_bits=0, remove_bits=0):
+    def update_bits(self, bases, add_bits=0, remove_bits=0, where=None):
+        """
+        Sets add_bits and clears remove_bits of the given pkgbases, or of all
+        packages matching where if bases is None, in one UPDATE. Error codes
+        are cleared along with the fail bit.
+        """
+        if bases is not None and not bases:
+            return 0
+        conditions, params = parse_where(where) if where else ([], {})
+        if bases is not None:
+            conditions.append("base = ANY(%(bases)s)")
+            params["bases"] = list(bases)
+        params.update(add=int(add_bits), remove=int(remove_bits), fail=int(PkgFlags.FAIL))
+        new_flags = "((COALESCE(flags, 0) | %(add)s) & ~%(remove)s)"
         try:
             with self.db.transaction() as cursor:
-                cursor.execute("SELECT flags FROM packages WHERE base = %s FOR UPDATE", (base,))
-                result = cursor.fetchone()
-
-                if result:
-                    current_flags = result[0] or 0
-                    new_flags = (current_flags | add_bits) & ~remove_bits
-
-                    # Logic: Clear error codes if the Fail bit is removed
-                    if (new_flags & PkgFlags.FAIL) == 0:
-                        new_flags &= 0xffff
-
-                    cursor.execute("UPDATE packages SET flags = %s WHERE base = %s", (new_flags, base))
-                    print(f"Updated flags for '{base}': {new_flags}")
-                else:
-                    print(f"No entry found for pkgbase '{base}'")
+                cursor.execute(f"""
+                    UPDATE packages SET flags = CASE
+                        WHEN {new_flags} & %(fail)s = 0 THEN {new_flags} & 65535
+                        ELSE {new_flags} END
+                    WHERE {" AND ".join(conditions) or "true"}
+                    RETURNING base, flags
+                """, params)
+                updated = {}
+                for base, flags in cursor.fetchall():
+                    updated[base] = flags
         except Exception as e:
             print(f"Update bits failed: {e}", file=sys.stderr)
+            return -1
+
+        if bases is not None and len(bases) == 1 and updated:
+            print(f"Updated flags for '{bases[0]}': {updated[bases[0]]}")
+        elif bases is None or len(bases) > 1:
+            print(f"Updated flags of {cursor.rowcount} package(s) in {len(updated)} pkgbase(s)")
+        for base in sorted(set(bases or []) - set(updated)):
+            print(f"No entry found for pkgbase '{base}'")
+        return len(updated)
+
+def parse_where(where):
+    """
+    Turns a selector like 'error=8,bit=nocheck,repo=core' into SQL
+    conditions and their parameters. error matches the error code, bit a set
+    bit, nobit an unset one and repo the loong repo.
+    """
+    conditions, params = [], {}
+    for i, term in enumerate(where.split(',')):
+        key, _, value = term.strip().partition('=')
+        name = f"where{i}"
+        if key == "error" and value.isdigit():
+            conditions.append(f"COALESCE(flags, 0) >> 16 = %({name})s")
+            params[name] = int(value)
+        elif key in ("bit", "nobit") and value in BIT_MAP:
+            op = "!=" if key == "bit" else "="
+            conditions.append(f"COALESCE(flags, 0) & %({name})s {op} 0")
+            params[name] = int(BIT_MAP[value])
+        elif key == "repo" and value:
+            conditions.append(f"repo = %({name})s")
+            params[name] = value
+        else:
+            raise ValueError(f"Bad --where term: '{term}'")
+    return conditions, params
 
 # Task Operations
 class TaskManager:
@@ -163,20 +247,10 @@ class TaskManager:
                         print(f"Fail: {conflict} already in tasklist.", file=sys.stderr)
                         return False
 
-                # 2. Lock table for atomic ordering calculation
-                cursor.execute("LOCK TABLE tasks IN SHARE ROW EXCLUSIVE MODE")
+                # 2. Serialize inserts into this list; builders taking tasks don't wait on it
+                cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", (TASK_LOCK, tasklist))
 
                 # 3. Calculate IDs
-                cursor.execute("SELECT min(taskno), max(taskno) FROM tasks WHERE tasklist=%s AND info IS NULL", (tasklist,))
-                result = cursor.fetchone()
-                first, last = result if result else (None, None)
-
-                if first is None:
-                    cursor.execute("SELECT max(taskno) FROM tasks WHERE tasklist=%s", (tasklist,))
-                    res = cursor.fetchone()
-                    first = (res[0] + 1) if res and res[0] is not None else 1
-                    last = first - 1
-
                 cursor.execute("SELECT max(taskid) FROM tasks WHERE tasklist=%s", (tasklist,))
                 res = cursor.fetchone()
                 maxid = (res[0] - 1) if res and res[0] is not None else 0
@@ -185,24 +259,96 @@ class TaskManager:
                     res = cursor.fetchone()
                     maxid = res[0] if res and res[0] is not None else 0
 
-                if taskno > first:
-                    first = taskno
-
-                # 4. Insert
-                if insert:
-                    cursor.execute("UPDATE tasks SET taskno=taskno+%s WHERE tasklist=%s AND taskno>=%s",
-                                   (len(pkgbase_list), tasklist, first))
-                else:
-                    first = last + 1
-
-                rows = [(i+first, pkgbase, maxid + 1, tasklist, repo) for i, pkgbase in enumerate(pkgbase_list)]
+                # 4. Order keys between the neighbours, only the new rows are written
+                count = len(pkgbase_list)
+                first = self.insertion_point(cursor, tasklist, insert, taskno)
+                keys = self.new_keys(cursor, tasklist, count, first)
+                if keys is None:
+                    # Open a gap for all of them where they go
+                    self.rebalance(cursor, tasklist, first, count)
+                    first = self.insertion_point(cursor, tasklist, insert, taskno)
+                    keys = self.new_keys(cursor, tasklist, count, first)
+                if keys is None:
+                    print(f"Fail: no room for {count} tasks in tasklist {tasklist}.", file=sys.stderr)
+                    return False
+
+                rows = [(key, pkgbase, maxid + 1, tasklist, repo) for key, pkgbase in zip(keys, pkgbase_list)]
                 insert_query = "INSERT INTO tasks (taskno, pkgbase, taskid, tasklist, repo) VALUES (%s, %s, %s, %s, %s)"
                 cursor.executemany(insert_query, rows)
+                # Delivered on commit, wakes up builders waiting in get_task
+                cursor.execute("SELECT pg_notify(%s, %s)", (TASK_CHANNEL, str(tasklist)))
                 return True
         except Exception as e:
             print(f"Insert failed: {e}", file=sys.stderr)
             return False
 
+    def key_at(self, cursor, tasklist, position):
+        """Order key of the task shown at position (from 1) in --show, None past the end."""
+        cursor.execute("SELECT taskno FROM tasks WHERE tasklist=%s ORDER BY taskno ASC OFFSET %s LIMIT 1",
+                       (tasklist, position - 1))
+        res = cursor.fetchone()
+        return res[0] if res else None
+
+    def insertion_point(self, cursor, tasklist, insert=False, position=0):
+        """
+        Order key new tasks go before: with insert the first waiting task (or
+        the task at position, if that comes later), None to append.
+        """
+        if not insert:
+            return None
+        cursor.execute("SELECT min(taskno) FROM tasks WHERE tasklist=%s AND info IS NULL", (tasklist,))
+        first = cursor.fetchone()[0]
+        if first is not None and position > 0:
+            at = self.key_at(cursor, tasklist, position)
+            first = max(first, at) if at is not None else None
+        return first
+
+    def new_keys(self, cursor, tasklist, count, first=None):
+        """
+        Order keys for count new tasks before the task keyed first, or after
+        the whole list. Appends leave TASK_GAP between tasks, inserts split
+        the gap they go into. Returns None if that gap is too small, the
+        list needs a rebalance first.
+        """
+        if first is None:
+            cursor.execute("SELECT max(taskno) FROM tasks WHERE tasklist=%s", (tasklist,))
+            last = cursor.fetchone()[0] or 0
+            if last + count * TASK_GAP > TASKNO_MAX:
+                return None
+            return [last + (i + 1) * TASK_GAP for i in range(count)]
+
+        cursor.execute("SELECT max(taskno) FROM tasks WHERE tasklist=%s AND taskno<%s", (tasklist, first))
+        low = cursor.fetchone()[0]
+        if low is None:
+            low = first - (count + 1) * TASK_GAP
+        step = (first - low) // (count + 1)
+        if step < 1 or low < -TASKNO_MAX:
+            return None
+        return [low + (i + 1) * step for i in range(count)]
+
+    def rebalance(self, cursor, tasklist, first=None, count=0):
+        """
+        Spreads the order keys of a list TASK_GAP apart again, keeping the
+        order. With first, leaves room for count tasks before the task keyed
+        first.
+        """
+        cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", (TASK_LOCK, tasklist))
+        cursor.execute("""
+            UPDATE tasks t SET taskno = r.pos * %(gap)s
+            FROM (SELECT ctid, row_number() OVER (ORDER BY taskno)
+                               + CASE WHEN taskno >= %(first)s THEN %(count)s ELSE 0 END AS pos
+                  FROM tasks WHERE tasklist=%(tasklist)s) r
+            WHERE t.ctid = r.ctid AND t.taskno != r.pos * %(gap)s
+        """, {"gap": TASK_GAP, "tasklist": tasklist, "first": first, "count": count})
+        return cursor.rowcount
+
+    def rebalance_list(self, tasklist):
+        try:
+            with self.db.transaction() as cursor:
+                print(f"{self.rebalance(cursor, tasklist)} task(s) renumbered")
+        except Exception as e:
+            print(f"Rebalance failed: {e}", file=sys.stderr)
+
     def remove_task(self, pkgbase, tasklist, remove=False, taskno=0):
         try:
             with self.db.transaction() as cursor:
@@ -211,7 +357,7 @@ class TaskManager:
                     params = [pkgbase, tasklist]
                     if taskno != 0:
                         query += " AND taskno=%s"
-                        params.append(taskno)
+                        params.append(self.key_at(cursor, tasklist, taskno))
                     cursor.execute(query, tuple(params))
                     print(f"{cursor.rowcount} task(s) deleted")
                 else:
@@ -244,7 +390,8 @@ class TaskManager:
         try:
             with self.db.transaction() as cursor:
                 cursor.execute("SELECT pkgbase, info, taskno FROM tasks WHERE tasklist=%s ORDER BY taskno ASC", (tasklist,))
-                for row in cursor.fetchall():
+                # taskno is a sparse order key, show positions instead
+                for position, row in enumerate(cursor.fetchall(), 1):
                     info = row[1] if row[1] else "waiting"
                     if row[0].startswith('%'): info = "command"
 
@@ -252,7 +399,7 @@ class TaskManager:
                         try:
                             info = f"failed: {ERROR_MESSAGES[int(info.split(':')[1])]}"
                         except: pass
-                    print(f"{row[2]:4} {row[0]:34} {info}")
+                    print(f"{position:4} {row[0]:34} {info}")
         except Exception as e:
             print(f"Show task failed: {e}", file=sys.stderr)
 
@@ -260,53 +407,39 @@ class TaskManager:
         try:
             with self.db.transaction() as cursor:
                 cursor.execute("""
-                    SELECT p.name, p.timecost, t.taskno
-                    FROM tasks t
-                    JOIN packages p ON t.pkgbase=p.name
-                    WHERE t.tasklist=%s AND t.info IS NULL
-                    ORDER BY p.timecost DESC NULLS LAST
+                    SELECT pkgbase, position
+                    FROM (SELECT pkgbase, info, row_number() OVER (ORDER BY taskno) AS position
+                          FROM tasks WHERE tasklist=%s) t
+                    WHERE info IS NULL AND left(pkgbase, 1) != '%%'
                 """, (tasklist,))
-                for row in cursor.fetchall():
-                    name = row[0]
-                    timecost = row[1] if row[1] is not None else "N/A"
-                    taskno = row[2]
-                    print(f"{taskno:5} {name:34} {timecost}")
+                rows = cursor.fetchall()
+                cost = costmodel.estimates(cursor, [row[0] for row in rows])
+                rows.sort(key=lambda row: -cost[row[0].split(':')[0]])
+                for name, taskno in rows:
+                    print(f"{taskno:5} {name:34} {cost[name.split(':')[0]]:.0f}")
         except Exception as e:
             print(f"Show task by cost failed: {e}", file=sys.stderr)
 
     def show_eta(self, tasklist):
+        """Simulates the queue on the builders, see eta.py."""
+        import eta
         try:
-            with self.db.transaction() as cursor:
-                cursor.execute("""
-                    SELECT SUM(p.timecost) AS total_timecost
-                    FROM tasks t
-                    JOIN packages p ON t.pkgbase = p.name
-                    WHERE t.tasklist = %s AND t.info IS NULL
-                """, (tasklist,))
-                result = cursor.fetchone()
-                total_seconds = result[0] if result and result[0] is not None else 0
-
-                if total_seconds == 0:
-                    print("No remaining tasks or no time cost data available.")
-                else:
-                    hours = int(total_seconds // 3600)
-                    minutes = int((total_seconds % 3600) // 60)
-                    seconds = int(total_seconds % 60)
-                    print(f"ETA: {hours:02d}:{minutes:02d}:{seconds:02d} (total: {total_seconds} seconds)")
+            eta.print_estimate(eta.estimate(self.db, tasklist))
         except Exception as e:
             print(f"Show ETA failed: {e}", file=sys.stderr)
 
     def show_hist(self, hist_no):
         try:
             with self.db.transaction() as cursor:
-                cursor.execute("SELECT max(taskid) from tasks")
+                # Through all_tasks, so old lists moved away by archive.py still show
+                cursor.execute("SELECT max(taskid) from all_tasks")
                 res = cursor.fetchone()
                 if not res or not res[0]:
                     print("No history in database")
                     return
 
                 target_id = res[0] - hist_no
-                cursor.execute("SELECT pkgbase, info, repo FROM tasks WHERE taskid=%s ORDER BY taskno ASC", (target_id,))
+                cursor.execute("SELECT pkgbase, info, repo FROM all_tasks WHERE taskid=%s ORDER BY taskno ASC", (target_id,))
 
                 print("pkgbase                            repo       result")
                 print("-" * 60)
@@ -321,36 +454,151 @@ class TaskManager:
         except Exception as e:
             print(f"Show history failed: {e}", file=sys.stderr)
 
-    def get_task(self, tasklist, building=False):
-        try:
-            with self.db.transaction() as cursor:
-                # SKIP LOCKED for concurrency safety
-                cursor.execute("""
-                    SELECT taskno, pkgbase FROM tasks
-                    WHERE tasklist=%s AND info IS NULL
-                    ORDER BY taskno ASC LIMIT 1
-                    FOR UPDATE SKIP LOCKED
-                """, (tasklist,))
-                result = cursor.fetchone()
-
-                if result:
-                    taskno, pkgbase = result
-                    if building and not pkgbase.startswith('%'):
-                        cursor.execute("UPDATE tasks SET info='building' WHERE tasklist=%s AND taskno=%s",
-                                       (tasklist, taskno))
-                    return pkgbase
-
-                # Cleanup and stop logic
-                if building:
-                    cursor.execute("UPDATE tasks SET tasklist=0 WHERE tasklist=%s AND info IS NOT NULL", (tasklist,))
-
-                cursor.execute("SELECT count(*) from tasks WHERE tasklist!=%s AND tasklist!=0", (tasklist,))
-                remain = cursor.fetchone()[0]
-                # Wait for other tasklist to finish if remain > 0
-                return "%stop" if remain > 0 else None
-        except Exception:
+    def pick_for_builder(self, cursor, tasklist, builder):
+        """
+        Picks the task that best fits the builder among the first
+        DISPATCH_WINDOW waiting ones. The fastest, largest builders take the
+        heaviest packages by costmodel estimate and the slower ones the lightest. Tasks
+        pinned to a builder (grouplist 'pin', builder name in info) only go
+        there, and packages that failed on a builder with less RAM than one
+        they built on are kept off builders that small. Queued commands are
+        barriers: nothing behind them is picked early. A builder missing
+        from the builder table takes the first task that suits it.
+        Returns (taskno, pkgbase), None if the list is empty, or False if no
+        waiting task suits this builder.
+        """
+        cursor.execute("SELECT name, ram, time_scale FROM builder")
+        builders = {name: (ram or 0, scale or 1.0) for name, ram, scale in cursor.fetchall()}
+        known = builder in builders
+        if not known:
+            print(f"Unknown builder '{builder}', taking tasks in order.", file=sys.stderr)
+        ram = builders[builder][0] if known else 0
+
+        cursor.execute("""
+            SELECT t.taskno, t.pkgbase, g.info
+            FROM tasks t
+            LEFT JOIN grouplist g ON g.group_name = 'pin' AND g.base = split_part(t.pkgbase, ':', 1)
+            WHERE t.tasklist=%s AND t.info IS NULL
+            ORDER BY t.taskno ASC LIMIT %s
+            FOR UPDATE OF t SKIP LOCKED
+        """, (tasklist, DISPATCH_WINDOW))
+        window = cursor.fetchall()
+        if not window:
             return None
 
+        candidates = []
+        for taskno, pkgbase, pin in window:
+            if pkgbase.startswith('%'):
+                if not candidates and not pin:
+                    return taskno, pkgbase
+                break
+            if pin == builder:
+                return taskno, pkgbase
+            if pin is None:
+                candidates.append((taskno, pkgbase))
+
+        # RAM floor: the most RAM of a builder it failed on, if it built fine on a bigger one
+        cursor.execute("""
+            SELECT l.pkgbase,
+                   max(b.ram) FILTER (WHERE l.build_result & %s != 0),
+                   min(b.ram) FILTER (WHERE l.build_result & %s = 0)
+            FROM logs l JOIN builder b ON b.id = l.builder
+            WHERE l.pkgbase = ANY(%s)
+            GROUP BY l.pkgbase
+        """, (int(PkgFlags.FAIL), int(PkgFlags.FAIL), [c[1].split(':')[0] for c in candidates]))
+        too_small = {base for base, fail_ram, ok_ram in cursor.fetchall()
+                     if fail_ram is not None and ok_ram is not None and ok_ram > fail_ram >= ram}
+        candidates = [c for c in candidates if c[1].split(':')[0] not in too_small]
+        if not candidates:
+            return False
+        if not known:
+            return candidates[0]
+
+        ranked = sorted(builders.values(), key=lambda b: (b[1], b[0]))
+        rank = ranked.index(builders[builder]) / max(len(ranked) - 1, 1)
+        estimate = costmodel.estimates(cursor, [c[1] for c in candidates])
+        cost = {taskno: estimate[pkgbase.split(':')[0]] for taskno, pkgbase in candidates}
+        by_cost = sorted(cost.values())
+        # Cost of the task this builder should take, lightest at rank 0;
+        # the earliest queued task of that cost wins.
+        target = by_cost[round(rank * (len(by_cost) - 1))]
+        return next((taskno, pkgbase) for taskno, pkgbase in candidates if cost[taskno] == target)
+
+    def listen(self):
+        with self.db.transaction() as cursor:
+            cursor.execute(f"LISTEN {TASK_CHANNEL}")
+
+    def wait_notify(self, timeout=60):
+        """Blocks until insert_task notifies, or timeout seconds pass."""
+        conn = self.db.conn
+        # A notify that came in during the last transaction is already read off the socket
+        conn.poll()
+        if not conn.notifies:
+            select.select([conn], [], [], timeout)
+            conn.poll()
+        conn.notifies.clear()
+
+    def get_task(self, tasklist, building=False, wait=False, builder=None):
+        while True:
+            try:
+                if wait:
+                    # Also re-listens if the connection had to be reopened
+                    self.listen()
+
+                with self.db.transaction() as cursor:
+                    if builder:
+                        result = self.pick_for_builder(cursor, tasklist, builder)
+                    else:
+                        # SKIP LOCKED for concurrency safety
+                        cursor.execute("""
+                            SELECT taskno, pkgbase FROM tasks
+                            WHERE tasklist=%s AND info IS NULL
+                            ORDER BY taskno ASC LIMIT 1
+                            FOR UPDATE SKIP LOCKED
+                        """, (tasklist,))
+                        result = cursor.fetchone()
+
+                    if result:
+                        taskno, pkgbase = result
+                        if building and not pkgbase.startswith('%'):
+                            cursor.execute("UPDATE tasks SET info='building' WHERE tasklist=%s AND taskno=%s",
+                                           (tasklist, taskno))
+                        return pkgbase
+
+                    if result is None:
+                        # Cleanup and stop logic
+                        if building:
+                            query = "UPDATE tasks SET tasklist=0 WHERE tasklist=%s AND info IS NOT NULL"
+                            if wait:
+                                # A waiter gets here on every wakeup: leave the tasks other
+                                # builders are still building for their remove_task to mark
+                                query += " AND info != 'building'"
+                            cursor.execute(query, (tasklist,))
+
+                        if not wait:
+                            cursor.execute("SELECT count(*) from tasks WHERE tasklist!=%s AND tasklist!=0", (tasklist,))
+                            remain = cursor.fetchone()[0]
+                            # Wait for other tasklist to finish if remain > 0
+                            return "%stop" if remain > 0 else None
+                    elif not wait:
+                        # Tasks are waiting, but they are for other builders
+                        return "%stop"
+
+                self.wait_notify()
+            except Exception as e:
+                if not wait:
+                    return None
+                # Returning would tell buildbot.sh the queue is done, so ride out
+                # dropped connections and database restarts instead
+                print(f"Error while waiting for a task: {e}", file=sys.stderr)
+                while True:
+                    time.sleep(WAIT_RETRY)
+                    try:
+                        self.db.reconnect()
+                        break
+                    except Exception as e:
+                        print(f"Reconnect failed: {e}", file=sys.stderr)
+
 def parse_bits(bit_arg):
     bitmask = 0
     for bit in bit_arg.split(','):
@@ -373,7 +621,9 @@ def parse_args():
     bit_parser.add_argument("--list", action="store_true", help="List bit names")
     bit_parser.add_argument("--get", action="store_true", help="Get current bitmask")
     bit_parser.add_argument("--show", action="store_true", help="Show meanings")
-    bit_parser.add_argument("pkgbase", type=str, nargs='?', help="Pkgbase")
+    bit_parser.add_argument("--where", type=str,
+                            help="With --add/--remove, select packages by 'error=N', 'bit=NAME', 'nobit=NAME' or 'repo=NAME', comma separated")
+    bit_parser.add_argument("pkgbase", type=str, nargs='*', help="Pkgbases, comma separated, or - to read them from stdin")
 
     # Task Command
     task_parser = subparsers.add_parser("task", help="Manage building task")
@@ -385,12 +635,16 @@ def parse_args():
     task_parser.add_argument("--get", action="store_true", help="Get one package")
     task_parser.add_argument("--done", type=str, help="Mark finished")
     task_parser.add_argument("--build", action="store_true", help="Get for build")
+    task_parser.add_argument("--builder", type=str, help="With --get, pick the queued task that best fits this builder")
+    task_parser.add_argument("--wait", action="store_true", help="With --get, block until a task is queued instead of returning None or %%stop")
     task_parser.add_argument("--list", type=int, default=1)
     task_parser.add_argument("--hist", type=int, default=-1)
     task_parser.add_argument("--stag", action="store_true", help="Staging repo")
     task_parser.add_argument("--test", action="store_true", help="Testing repo")
     task_parser.add_argument("--taskno", type=int, default=0)
     task_parser.add_argument("--eta", action="store_true", help="Show ETA for remaining tasks")
+    task_parser.add_argument("--rebalance", action="store_true",
+                             help="Spread the order keys of the list out again, e.g. from cron")
 
     return parser.parse_args()
 
@@ -410,23 +664,35 @@ def main():
         task_mgr = TaskManager(db)
 
         if args.command == "bit":
-            if not args.pkgbase:
+            bases = [b for arg in args.pkgbase for b in arg.split(',') if b]
+            if '-' in bases:
+                bases = [b for b in bases if b != '-'] + sys.stdin.read().split()
+            if not args.pkgbase and not (args.where and (args.add or args.remove)):
                 print("Error: 'pkgbase' required.", file=sys.stderr)
                 return
+            if args.pkgbase and not bases:
+                # An empty list, e.g. from an empty pipe, never means all packages
+                print("No pkgbase given, nothing changed.")
+                return
 
             if args.get or args.show:
-                bits = bit_mgr.get_bits(args.pkgbase)
-                if args.get: print(bits)
-                if args.show:
-                    for k, v in BIT_MAP.items():
-                        if bits & v: print(k)
-                    err = bits >> 16
-                    if 0 < err < len(ERROR_MESSAGES): print(ERROR_MESSAGES[err])
+                for base in bases:
+                    bits = bit_mgr.get_bits(base)
+                    if len(bases) > 1: print(f"{base}:")
+                    if args.get: print(bits)
+                    if args.show:
+                        for k, v in BIT_MAP.items():
+                            if bits & v: print(k)
+                        err = bits >> 16
+                        if 0 < err < len(ERROR_MESSAGES): print(ERROR_MESSAGES[err])
 
             if args.add or args.remove:
                 add = parse_bits(args.add) if args.add else 0
                 rem = parse_bits(args.remove) if args.remove else 0
-                bit_mgr.update_bits(args.pkgbase, add, rem)
+                try:
+                    bit_mgr.update_bits(bases if args.pkgbase else None, add, rem, args.where)
+                except ValueError as e:
+                    print(f"Error: {e}", file=sys.stderr)
 
         elif args.command == "task":
             repo = 1 if args.test else 2 if args.stag else 0
@@ -434,13 +700,14 @@ def main():
             if args.add: task_mgr.insert_task(args.add, args.list, repo)
             if args.insert: task_mgr.insert_task(args.insert, args.list, repo, True, args.taskno)
             if args.get:
-                print(task_mgr.get_task(args.list, args.build))
+                print(task_mgr.get_task(args.list, args.build, args.wait, args.builder))
             if args.remove: task_mgr.remove_task(args.remove, args.list, True, args.taskno)
             if args.done: task_mgr.remove_task(args.done, args.list)
             if args.show: task_mgr.show_task(args.list)
             if args.hist >= 0: task_mgr.show_hist(args.hist)
             if args.cost: task_mgr.show_task_by_cost(args.list)
             if args.eta: task_mgr.show_eta(args.list)
+            if args.rebalance: task_mgr.rebalance_list(args.list)
 
 if __name__ == "__main__":
     try:
@@ -3,21 +3,15 @@
 import argparse
 import os
 import sys
-import pyalpm
-from pydantic import BaseModel
+import time
 import dbcmd
+import syncdb
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
 
-class PackageMetadata(BaseModel):
-    name: str = None
-    base: str = None
-    x86_version: str = None
-    loong_version: str = None
-    x86_testing_version: str = None
-    loong_testing_version: str = None
-    x86_staging_version: str = None
-    loong_staging_version: str = None
-    repo: str = None
+# Columns of the rows compare_all returns, as inserted into packages
+ROW_FIELDS = ['name', 'base', 'repo', 'x86_version', 'loong_version', 'x86_testing_version',
+              'loong_testing_version', 'x86_staging_version', 'loong_staging_version', 'x86_size']
 
 def load_black_list(db_manager, bl_file, info):
     """Loads banned packages from a file into the database."""
@@ -46,74 +40,62 @@ def load_black_list(db_manager, bl_file, info):
         print(f"Inserted {len(pkgs)} packages into the blacklist.")
 
 
-def load_repo(repo_path, repo):
-    """Load the pyalpm repository database."""
-    handle = pyalpm.Handle("/", repo_path)
-    try:
-        db = handle.register_syncdb(repo, 0)
-        return db
-    except pyalpm.error as e:
-        print(f"Failed to load repo {repo_path}: {e}", file=sys.stderr)
-        return None
+def load_repo(path):
+    """Reads one sync db in a worker, returns its name/base/version/size columns and the time taken."""
+    start = time.perf_counter()
+    names, bases, versions, descs = syncdb.read_db(path)
+    sizes = [int(syncdb.desc_field(desc, "ISIZE") or 0) for desc in descs]
+    return names, bases, versions, sizes, time.perf_counter() - start
 
 
-def compare_all(cache_dir, x86_repo_path, loong64_repo_path):
-    """Fetch all packages from x86 and loong using pyalpm."""
-    pkg_map = {}
+def compare_all(cache_dir, x86_repo_path, loong64_repo_path, timing=None):
+    """Fetch all packages from x86 and loong, one worker process per db."""
     repos = ['core', 'extra', 'core-testing', 'extra-testing', 'core-staging', 'extra-staging']
-
+    # (repo, version column, path) of each db, x86 before loong within a repo
+    jobs = []
     for repo in repos:
-        x86_db = load_repo(os.path.join(cache_dir, x86_repo_path), repo)
-        x86_data = {pkg.name: [pkg.base, pkg.version] for pkg in x86_db.pkgcache} if x86_db else {}
-
-        loong_db = load_repo(os.path.join(cache_dir, loong64_repo_path), repo)
-        loong_data = {pkg.name: [pkg.base, pkg.version] for pkg in loong_db.pkgcache} if loong_db else {}
-
-        all_current_names = set(x86_data.keys()) | set(loong_data.keys())
-
-        is_staging = 'staging' in repo
-        is_testing = 'testing' in repo
+        kind = 'staging' if 'staging' in repo else 'testing' if 'testing' in repo else None
+        for arch_path, arch in ((x86_repo_path, 'x86'), (loong64_repo_path, 'loong')):
+            column = f"{arch}_{kind}_version" if kind else f"{arch}_version"
+            jobs.append((repo, ROW_FIELDS.index(column), os.path.join(cache_dir, arch_path, "sync", f"{repo}.db")))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as pool:
+        loaded = list(pool.map(load_repo, [path for _, _, path in jobs]))
+    load_time = time.perf_counter() - start
+
+    # One pass over all dbs: the first db a name shows up in gives its base and repo
+    start = time.perf_counter()
+    rows = {}
+    size_column = ROW_FIELDS.index('x86_size')
+    for (repo, column, _), (names, bases, versions, sizes, _) in zip(jobs, loaded):
         clean_repo_name = repo.replace('-testing', '').replace('-staging', '')
-
-        for name in all_current_names:
-            if name not in pkg_map:
-                pkg_map[name] = PackageMetadata(name=name)
-
-            p = pkg_map[name]
-
-            x86_info = x86_data.get(name)
-            loong_info = loong_data.get(name)
-
-            # Update Metadata (Base & Repo)
-            current_base = x86_info[0] if x86_info else (loong_info[0] if loong_info else None)
-
-            if p.base is None and current_base:
-                p.base = current_base
-
-            if p.repo is None:
-                p.repo = clean_repo_name
-
-            # Update Versions
-            if is_staging:
-                if x86_info: p.x86_staging_version = x86_info[1]
-                if loong_info: p.loong_staging_version = loong_info[1]
-            elif is_testing:
-                if x86_info: p.x86_testing_version = x86_info[1]
-                if loong_info: p.loong_testing_version = loong_info[1]
-            else: # Stable
-                if x86_info: p.x86_version = x86_info[1]
-                if loong_info: p.loong_version = loong_info[1]
-
-    return list(pkg_map.values())
+        x86 = ROW_FIELDS[column].startswith('x86')
+        for name, base, version, size in zip(names, bases, versions, sizes):
+            row = rows.get(name)
+            if row is None:
+                row = rows[name] = [name, base, clean_repo_name] + [None] * 7
+            row[column] = version
+            # Installed size on x86, from the first repo having it; a guess for costmodel
+            if x86 and row[size_column] is None:
+                row[size_column] = size
+
+    if timing is not None:
+        timing["read"] = sum(res[4] for res in loaded)
+        timing["load"] = load_time
+        timing["merge"] = time.perf_counter() - start
+    return list(rows.values())
 
 
 def fetch_all_packages(db_manager):
-    """Syncs the pyalpm package cache with the PostgreSQL database."""
+    """Syncs the local sync db cache with the PostgreSQL database."""
     home_dir = os.path.expanduser("~")
     cache_dir = os.path.join(home_dir, ".cache", "compare86")
 
-    pkglist = compare_all(cache_dir, "x86", "loong")
+    timing = {}
+    pkglist = compare_all(cache_dir, "x86", "loong", timing)
     print(f"Loaded {len(pkglist)} packages from local cache.")
+    start = time.perf_counter()
 
     # Bit mask (1<<30) is used as a temporary 'touched' flag
     touched_flag = 1 << 30
@@ -122,8 +104,8 @@ def fetch_all_packages(db_manager):
         # Upsert packages
         cursor.executemany('''
             INSERT INTO packages (name, base, repo, flags, x86_version, loong_version,
-            x86_testing_version, loong_testing_version, x86_staging_version, loong_staging_version)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            x86_testing_version, loong_testing_version, x86_staging_version, loong_staging_version, x86_size)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             ON CONFLICT (name) DO UPDATE
             SET x86_version = EXCLUDED.x86_version,
                 loong_version = EXCLUDED.loong_version,
@@ -131,15 +113,14 @@ def fetch_all_packages(db_manager):
                 x86_staging_version = EXCLUDED.x86_staging_version,
                 loong_testing_version = EXCLUDED.loong_testing_version,
                 loong_staging_version = EXCLUDED.loong_staging_version,
+                x86_size = EXCLUDED.x86_size,
                 repo = EXCLUDED.repo,
                 base = EXCLUDED.base,
                 flags = CASE
                     WHEN packages.flags is NULL then EXCLUDED.flags
                     ELSE packages.flags | EXCLUDED.flags
                 END
-        ''', [(pkg.name, pkg.base, pkg.repo, touched_flag, pkg.x86_version, pkg.loong_version,
-               pkg.x86_testing_version, pkg.loong_testing_version, pkg.x86_staging_version,
-               pkg.loong_staging_version) for pkg in pkglist])
+        ''', [(*row[:3], touched_flag, *row[3:]) for row in pkglist])
 
         # Delete packages that weren't touched in this sync
 
@@ -157,6 +138,10 @@ def fetch_all_packages(db_manager):
         utc_time_str = datetime.now(timezone.utc).isoformat()
         cursor.execute("UPDATE last_update SET last_update = %s", (utc_time_str,))
 
+    print(f"Timing: read {timing['read']:.2f}s of dbs in {timing['load']:.2f}s "
+          f"(saved {timing['read'] - timing['load']:.2f}s), merge {timing['merge']:.2f}s, "
+          f"database {time.perf_counter() - start:.2f}s")
+
 def log_check(db_manager):
     """Check if log files exist for packages and update the DB."""
     base_dir = '/home/arch/loong-status/build_logs'
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import sys
+import dbcmd
+
+# Each migration is (version, description, statements). Append new ones at the
+# end with the next version number; never edit one that has been applied.
+MIGRATIONS = [
+    (1, "Indexes for the hot dbcmd queries", [
+        # get_bits, update_bits, parselog, filterpkg
+        "CREATE INDEX IF NOT EXISTS packages_base_idx ON packages (base)",
+        # get_task: next waiting task of a list
+        "CREATE INDEX IF NOT EXISTS tasks_waiting_idx ON tasks (tasklist, taskno) WHERE info IS NULL",
+        # show_task
+        "CREATE INDEX IF NOT EXISTS tasks_list_idx ON tasks (tasklist, taskno)",
+        # insert_task duplicate check, remove_task
+        "CREATE INDEX IF NOT EXISTS tasks_pkgbase_idx ON tasks (pkgbase, tasklist)",
+        # show_hist
+        "CREATE INDEX IF NOT EXISTS tasks_taskid_idx ON tasks (taskid, taskno)",
+        # remove_task: latest log of a package
+        "CREATE INDEX IF NOT EXISTS logs_pkgbase_time_idx ON logs (pkgbase, build_time DESC)",
+        "CREATE INDEX IF NOT EXISTS grouplist_group_base_idx ON grouplist (group_name, base)",
+    ]),
+    (2, "Build durations and the timecost estimates of costmodel.py", [
+        "ALTER TABLE logs ADD COLUMN IF NOT EXISTS duration INTEGER",
+        "ALTER TABLE packages ADD COLUMN IF NOT EXISTS x86_size BIGINT",
+        """CREATE TABLE IF NOT EXISTS timecost (
+               base TEXT PRIMARY KEY,
+               estimate REAL NOT NULL,
+               samples INTEGER NOT NULL DEFAULT 0,
+               updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )""",
+        # Start from the last build time, the only one known so far
+        """INSERT INTO timecost (base, estimate, samples)
+           SELECT base, max(timecost), 1 FROM packages
+           WHERE base IS NOT NULL AND timecost IS NOT NULL GROUP BY base
+           ON CONFLICT DO NOTHING""",
+    ]),
+    (3, "Monthly history partitions for old logs and finished tasks, see archive.py", [
+        """CREATE TABLE IF NOT EXISTS logs_history (
+               id INTEGER,
+               pkgbase TEXT,
+               builder INTEGER,
+               build_result INTEGER,
+               build_time TIMESTAMP NOT NULL,
+               duration INTEGER
+           ) PARTITION BY RANGE (build_time)""",
+        """CREATE TABLE IF NOT EXISTS tasks_history (
+               taskno INTEGER,
+               pkgbase TEXT,
+               tasklist INTEGER,
+               info TEXT,
+               repo INTEGER,
+               taskid INTEGER,
+               logid INTEGER,
+               finished TIMESTAMP NOT NULL
+           ) PARTITION BY RANGE (finished)""",
+        "CREATE INDEX IF NOT EXISTS logs_history_id_idx ON logs_history (id)",
+        "CREATE INDEX IF NOT EXISTS logs_history_pkgbase_time_idx ON logs_history (pkgbase, build_time DESC)",
+        "CREATE INDEX IF NOT EXISTS tasks_history_taskid_idx ON tasks_history (taskid, taskno)",
+        # archive.py: logs older than the retention
+        "CREATE INDEX IF NOT EXISTS logs_build_time_idx ON logs (build_time)",
+        # show_hist and the status site read live and archived rows through these
+        """CREATE OR REPLACE VIEW all_logs AS
+               SELECT id, pkgbase, builder, build_result, build_time, duration FROM logs
+               UNION ALL
+               SELECT id, pkgbase, builder, build_result, build_time, duration FROM logs_history""",
+        """CREATE OR REPLACE VIEW all_tasks AS
+               SELECT taskno, pkgbase, tasklist, info, repo, taskid, logid FROM tasks
+               UNION ALL
+               SELECT taskno, pkgbase, tasklist, info, repo, taskid, logid FROM tasks_history""",
+    ]),
+]
+
+# The dbcmd queries to time with --bench, as (name, query). Parameters are
+# filled in from sample_params().
+BENCH_QUERIES = [
+    ("get_bits", "SELECT flags FROM packages WHERE base = %(base)s"),
+    ("get_task", """SELECT taskno, pkgbase FROM tasks
+                    WHERE tasklist=%(tasklist)s AND info IS NULL
+                    ORDER BY taskno ASC LIMIT 1"""),
+    ("show_task", "SELECT pkgbase, info, taskno FROM tasks WHERE tasklist=%(tasklist)s ORDER BY taskno ASC"),
+    ("insert_task", "SELECT pkgbase FROM tasks WHERE pkgbase = ANY(%(bases)s) AND tasklist!=0"),
+    ("remove_task", """SELECT id FROM logs
+                       WHERE pkgbase=%(base)s AND build_time > NOW() - INTERVAL '1 hour'
+                       ORDER BY build_time DESC limit 1"""),
+    ("show_hist", "SELECT pkgbase, info, repo FROM tasks WHERE taskid=%(taskid)s ORDER BY taskno ASC"),
+    ("show_eta", """SELECT SUM(p.timecost) FROM tasks t
+                    JOIN packages p ON t.pkgbase = p.name
+                    WHERE t.tasklist = %(tasklist)s AND t.info IS NULL"""),
+    ("filterpkg", "SELECT base FROM grouplist WHERE group_name='black' AND base = ANY(%(bases)s)"),
+]
+
+
+def ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def current_version(db_manager):
+    with db_manager.transaction() as cursor:
+        ensure_version_table(cursor)
+        cursor.execute("SELECT max(version) FROM schema_version")
+        res = cursor.fetchone()
+        return res[0] if res and res[0] is not None else 0
+
+
+def migrate(db_manager, target=None):
+    """Applies pending migrations up to target, one transaction each."""
+    version = current_version(db_manager)
+    for number, description, statements in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        with db_manager.transaction() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                           (number, description))
+        print(f"Applied migration {number}: {description}")
+        version = number
+    print(f"Schema version: {version}")
+
+
+def sample_params(db_manager):
+    with db_manager.transaction() as cursor:
+        cursor.execute("SELECT base FROM packages WHERE base IS NOT NULL LIMIT 20")
+        bases = [row[0] for row in cursor.fetchall()] or ['glibc']
+        cursor.execute("SELECT tasklist, max(taskid) FROM tasks GROUP BY tasklist ORDER BY count(*) DESC LIMIT 1")
+        res = cursor.fetchone()
+    tasklist, taskid = res if res else (1, 0)
+    return {"base": bases[0], "bases": bases, "tasklist": tasklist, "taskid": taskid}
+
+
+def bench(db_manager, runs=5):
+    """Runs EXPLAIN ANALYZE on each query and returns {name: (best ms, plan node)}."""
+    params = sample_params(db_manager)
+    results = {}
+    for name, query in BENCH_QUERIES:
+        timings = []
+        node = ""
+        with db_manager.transaction() as cursor:
+            for _ in range(runs):
+                cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, params)
+                plan = cursor.fetchone()[0]
+                plan = plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+                timings.append(plan["Planning Time"] + plan["Execution Time"])
+                node = plan["Plan"]["Node Type"]
+        results[name] = (min(timings), node)
+    return results
+
+
+def print_bench(before, after=None):
+    if after is None:
+        for name, (ms, node) in before.items():
+            print(f"{name:12} {ms:10.3f} ms  {node}")
+        return
+    print(f"{'query':12} {'before':>12} {'after':>12}  plan")
+    for name, (ms, node) in before.items():
+        after_ms, after_node = after[name]
+        print(f"{name:12} {ms:9.3f} ms {after_ms:9.3f} ms  {node} -> {after_node}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the status database schema.")
+    parser.add_argument("-u", "--upgrade", action="store_true", help="Apply pending migrations")
+    parser.add_argument("-t", "--target", type=int, help="Stop at this schema version")
+    parser.add_argument("-s", "--status", action="store_true", help="Show schema version and pending migrations")
+    parser.add_argument("-b", "--bench", action="store_true",
+                        help="Time the dbcmd queries with EXPLAIN ANALYZE, before and after --upgrade")
+    args = parser.parse_args()
+
+    with dbcmd.DatabaseManager() as db_manager:
+        if args.status:
+            version = current_version(db_manager)
+            print(f"Schema version: {version}")
+            for number, description, _ in MIGRATIONS:
+                if number > version:
+                    print(f"Pending {number}: {description}")
+
+        before = bench(db_manager) if args.bench else None
+        if args.upgrade:
+            migrate(db_manager, args.target)
+        if args.bench:
+            print_bench(before, bench(db_manager) if args.upgrade else None)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
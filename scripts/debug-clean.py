@@ -1,142 +1,167 @@
 #!/usr/bin/env python3
 
+import argparse
+import errno
 import os
-import sys
 import re
+import shutil
+import sys
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import cmp_to_key
+
+import pyalpm
 from dbcmd import DatabaseManager
 
-def get_package_bases_from_db(db_manager):
-    """Fetch all unique base names from database"""
-    bases = set()
+# Match pattern: base-debug-version-[loong64|any].pkg.tar.zst
+# Version can contain digits, dots, dashes (e.g., 0.6.1-3, 4.0.3-5)
+DEBUG_PKG_RE = re.compile(r'^(.+)-debug-(.+)-(loong64|any)\.pkg\.tar\.zst$')
+
+
+class DebugFile:
+    """One debug package in the pool, with its optional .sig file."""
+
+    def __init__(self, filename, version, size, sig=None, sig_size=0):
+        self.filename = filename
+        self.version = version
+        self.size = size
+        self.sig = sig
+        self.sig_size = sig_size
+
+    @property
+    def total_size(self):
+        return self.size + self.sig_size
+
+
+def scan_pool(directory):
+    """
+    Index the debug pool in a single os.scandir pass.
+    Returns {base: [DebugFile, ...]} and the .zst files that failed to parse.
+    """
+    index = defaultdict(list)
+    unparsed = []
+    sigs = {}
+    try:
+        with os.scandir(directory) as it:
+            entries = [(entry.name, entry.stat(follow_symlinks=False).st_size) for entry in it if entry.is_file()]
+    except Exception as e:
+        print(f"Error reading directory {directory}: {e}", file=sys.stderr)
+        return index, unparsed
+
+    for name, size in entries:
+        if name.endswith('.zst.sig'):
+            sigs[name[:-4]] = size
+
+    for name, size in sorted(entries):
+        if not name.endswith('.zst'):
+            continue
+        match = DEBUG_PKG_RE.match(name)
+        if not match:
+            unparsed.append(name)
+            continue
+        sig = name + '.sig' if name in sigs else None
+        index[match.group(1)].append(DebugFile(name, match.group(2), size, sig, sigs.get(name, 0)))
+    return index, unparsed
+
+
+def get_package_bases_from_db(db_manager, bases):
+    """Fetch which of the given base names exist in the database"""
+    found = set()
     try:
         with db_manager.transaction() as cursor:
-            cursor.execute("SELECT DISTINCT base FROM packages")
+            cursor.execute("SELECT DISTINCT base FROM packages WHERE base = ANY(%s)", (list(bases),))
             for row in cursor.fetchall():
-                if row[0]:
-                    bases.add(row[0])
+                found.add(row[0])
     except Exception as e:
         print(f"Error fetching bases from database: {e}", file=sys.stderr)
-    return bases
+        sys.exit(1)
+    return found
+
+
+def split_old_versions(files):
+    """Returns the newest file by vercmp and the older ones."""
+    files = sorted(files, key=cmp_to_key(lambda a, b: pyalpm.vercmp(a.version, b.version)))
+    return files[-1], files[:-1]
+
 
-def find_zst_files(directory):
-    """Find all *.zst files in the specified directory"""
-    zst_files = []
+def move_one(src, dst):
     try:
-        for filename in os.listdir(directory):
-            if filename.endswith('.zst'):
-                zst_files.append(filename)
-    except Exception as e:
-        print(f"Error reading directory {directory}: {e}", file=sys.stderr)
-    return sorted(zst_files)
+        # Same filesystem: a rename only touches the directory entries
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
 
-def extract_base_and_version_from_filename(filename):
-    """
-    Extract base name and version from filename
-    Format: $(base)-debug-$(version)-[loong64|any].pkg.tar.zst
-    """
-    # Match pattern: base-debug-version-[loong64|any].pkg.tar.zst
-    # Version can contain digits, dots, dashes (e.g., 0.6.1-3, 4.0.3-5)
-    pattern = r'^(.+)-debug-(.+)-(loong64|any)\.pkg\.tar\.zst$'
-    match = re.match(pattern, filename)
-    if match:
-        return match.group(1), match.group(2)
-    return None, None
 
-def find_multiversion_files(zst_files):
-    """Find files with the same base but different versions"""
-    from collections import defaultdict
+def move_files(files, directory, dest, jobs):
+    """Move the files and their .sig files, in parallel."""
+    names = [name for f in files for name in (f.filename, f.sig) if name]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(lambda name: move_one(os.path.join(directory, name), os.path.join(dest, name)), names))
+    return len(names)
 
-    base_versions = defaultdict(list)
-    for filename in zst_files:
-        base, version = extract_base_and_version_from_filename(filename)
-        if base:
-            base_versions[base].append((filename, version))
 
-    # Filter to only include bases with multiple versions
-    multiversion = {base: files for base, files in base_versions.items() if len(files) > 1}
-    return multiversion
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python debug-clean.py <directory_path>", file=sys.stderr)
-        print("Example: python debug-clean.py /path/to/packages", file=sys.stderr)
-        sys.exit(1)
-
-    directory = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Clean stale files from the debug package pool.")
+    parser.add_argument("directory", help="Debug pool directory")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="Only report what would be moved and the space reclaimed")
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="Parallel moves")
+    args = parser.parse_args()
 
+    directory = args.directory
     if not os.path.isdir(directory):
         print(f"Error: '{directory}' is not a valid directory", file=sys.stderr)
         sys.exit(1)
 
-    # Create temporary directory for unmatched files
-    import tempfile
-    import shutil
-    temp_dir = tempfile.mkdtemp(prefix='debug-clean-unmatched-')
+    print(f"Scanning directory: {directory}")
+    index, unparsed = scan_pool(directory)
+    print(f"Found {sum(map(len, index.values()))} debug packages of {len(index)} bases\n")
+    for filename in unparsed:
+        print(f"  {filename} (Failed to parse base)")
 
-    # Fetch bases from database
     print("Loading package bases from database...")
     with DatabaseManager() as db:
-        db_bases = get_package_bases_from_db(db)
-        print(f"Found {len(db_bases)} unique bases in database")
-
-        # Find all zst files
-        print(f"\nScanning directory: {directory}")
-        zst_files = find_zst_files(directory)
-        print(f"Found {len(zst_files)} .zst files\n")
-
-        # Check each file
-        print("Checking unmatched debug packages...")
-
-        unmatched_files = []
-        for filename in zst_files:
-            base, version = extract_base_and_version_from_filename(filename)
-            if base:
-                if base not in db_bases:
-                    unmatched_files.append(filename)
-            else:
-                print(f"  {filename} (Failed to parse base)")
-
-        # Find files with multiple versions BEFORE moving
-        multiversion = find_multiversion_files(zst_files)
-
-        print(f"\nFound {len(unmatched_files)} files with base not in database")
-
-        # Print unmatched files (only if not moving)
-        if not unmatched_files:
-            print("\nNo unmatched files found.")
-        else:
-            print("\nUnmatched files:")
-            for f in unmatched_files:
-                print(f"  {f}")
-
-            # Move unmatched files and their .sig files to temp directory
-            print(f"\nMoving unmatched files to: {temp_dir}")
-            for filename in unmatched_files:
-                src = os.path.join(directory, filename)
-                dst = os.path.join(temp_dir, filename)
-                if os.path.exists(src):
-                    shutil.move(src, dst)
-                    # Also move .sig file if exists
-                    sig_src = src + '.sig'
-                    sig_dst = dst + '.sig'
-                    if os.path.exists(sig_src):
-                        shutil.move(sig_src, sig_dst)
-                        print(f"    Moved: {filename} and {filename}.sig")
-                    else:
-                        print(f"    Moved: {filename} (no .sig file)")
-
-            print(f"Temporary directory for unmatched files: {temp_dir}")
-
-        # Find files with multiple versions (already done above)
-        if multiversion:
-            for base, files in sorted(multiversion.items()):
-                print(f"\nBase: {base}")
-                for filename, version in sorted(files, key=lambda x: x[1]):
-                    print(f"  {filename} (version: {version})")
-            print(f"\nTotal: {len(multiversion)} base(s) with multiple versions")
-        else:
-            print("\nNo files with multiple versions found.")
+        db_bases = get_package_bases_from_db(db, index.keys())
+    print(f"Found {len(db_bases)} of them in database")
+
+    unmatched = []
+    old_versions = []
+    for base, files in sorted(index.items()):
+        if base not in db_bases:
+            unmatched.extend(files)
+        elif len(files) > 1:
+            newest, older = split_old_versions(files)
+            print(f"\nBase: {base}, keeping {newest.filename}")
+            for f in older:
+                print(f"  {f.filename} (version: {f.version})")
+            old_versions.extend(older)
+
+    print(f"\nFound {len(unmatched)} files with base not in database")
+    for f in unmatched:
+        print(f"  {f.filename}" + ("" if f.sig else " (no .sig file)"))
+    print(f"Found {len(old_versions)} files superseded by a newer version")
+
+    to_move = unmatched + old_versions
+    reclaimable = sum(f.total_size for f in to_move)
+    print(f"\nReclaimable: {format_size(reclaimable)} in {len(to_move)} packages")
+    if args.dry_run or not to_move:
+        return
+
+    # Keep the temporary directory next to the pool so moves are renames
+    temp_dir = tempfile.mkdtemp(prefix='debug-clean-unmatched-', dir=os.path.dirname(os.path.abspath(directory)))
+    print(f"Moving files to: {temp_dir}")
+    moved = move_files(to_move, directory, temp_dir, args.jobs)
+    print(f"Moved {moved} files, temporary directory for unmatched files: {temp_dir}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Projects when a build queue finishes by simulating it on the builders.
+
+Each builder takes the first ready task in queue order whenever it is free,
+the fastest idle builder first. A task runs for its costmodel estimate divided
+by the builder's time_scale (the estimates are normalized by it), shortened by its
+chance to fail early, and is ready once the queued packages it depends on
+that come before it in the queue are built. Queued commands are barriers.
+The dependencies come from the x86 sync dbs, through an index of them that
+is cached until a db changes.
+
+The result has the projected finish time, the utilization of each builder
+and the critical chain: the tasks, linked by dependency or by waiting for
+the same builder, that decided the finish time.
+"""
+
+import argparse
+import heapq
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import costmodel
+import dbcmd
+
+X86_DBPATH = os.path.join(os.path.expanduser("~"), ".cache", "compare86", "x86")
+X86_REPOS = ['core', 'extra', 'core-testing', 'extra-testing', 'core-staging', 'extra-staging']
+# Dependencies of every x86 package base, so an estimate doesn't parse the dbs
+DEPS_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "compare86", "eta-deps.json")
+# A failed build stops this far into its run on average
+FAIL_FRACTION = 0.5
+# Weight of the overall failure rate against the history of one package
+FAIL_PRIOR = 2
+# Share of its run a task already building still has to go
+BUILDING_LEFT = 0.5
+
+
+class Task:
+    __slots__ = ("index", "pkgbase", "cost", "fail", "nocheck", "building", "deps",
+                 "dependents", "start", "end", "builder", "after")
+
+    def __init__(self, index, pkgbase, cost, fail=0.0, nocheck=False, building=False):
+        self.index = index
+        self.pkgbase = pkgbase
+        self.cost = cost
+        self.fail = fail
+        self.nocheck = nocheck
+        self.building = building
+        self.deps = set()
+        self.dependents = []
+        self.start = self.end = None
+        self.builder = None
+        # (task, "depends"|"builder") that decided when this one started
+        self.after = None
+
+    @property
+    def base(self):
+        return self.pkgbase.split(':')[0]
+
+    def duration(self, scale):
+        expected = self.cost * (1 - self.fail * (1 - FAIL_FRACTION))
+        return expected * (BUILDING_LEFT if self.building else 1) / scale
+
+
+def load_tasks(cursor, tasklist):
+    """The waiting and building tasks of a list in queue order, with estimates and failure rates."""
+    fail = int(dbcmd.PkgFlags.FAIL)
+    cursor.execute("SELECT avg((build_result & %s != 0)::int) FROM logs", (fail,))
+    base_rate = float(cursor.fetchone()[0] or 0)
+    cursor.execute("""
+        SELECT t.pkgbase, t.info, p.flags, l.attempts, l.failures
+        FROM tasks t
+        LEFT JOIN LATERAL (
+            SELECT bit_or(flags) AS flags FROM packages
+            WHERE base = split_part(t.pkgbase, ':', 1)
+        ) p ON true
+        LEFT JOIN LATERAL (
+            SELECT count(*) AS attempts, count(*) FILTER (WHERE build_result & %s != 0) AS failures
+            FROM logs WHERE pkgbase = split_part(t.pkgbase, ':', 1)
+        ) l ON true
+        WHERE t.tasklist=%s AND (t.info IS NULL OR t.info='building')
+        ORDER BY t.taskno ASC
+    """, (fail, tasklist))
+    rows = cursor.fetchall()
+
+    cost = costmodel.estimates(cursor, [row[0] for row in rows])
+    tasks = []
+    for pkgbase, info, flags, attempts, failures in rows:
+        if pkgbase.startswith('%'):
+            tasks.append(Task(len(tasks), pkgbase, 0))
+            continue
+        rate = (failures + base_rate * FAIL_PRIOR) / (attempts + FAIL_PRIOR)
+        tasks.append(Task(len(tasks), pkgbase, cost[pkgbase.split(':')[0]], rate,
+                          bool((flags or 0) & dbcmd.PkgFlags.NOCHECK), info == 'building'))
+    return tasks
+
+
+def load_builders(cursor, names=None):
+    """{name: time_scale} of the registered builders, or of the named ones."""
+    cursor.execute("SELECT name, time_scale FROM builder ORDER BY id")
+    builders = {name: scale or 1.0 for name, scale in cursor.fetchall()}
+    if names:
+        unknown = [name for name in names if name not in builders]
+        if unknown:
+            print(f"Unknown builder(s) {', '.join(unknown)}, counted at time_scale 1.0", file=sys.stderr)
+        builders = {name: builders.get(name, 1.0) for name in names}
+    return builders
+
+
+def db_stamp(dbpath, repos):
+    """Path, mtime and size of the sync dbs, to tell when the dependency index is stale."""
+    stamp = {"dbpath": os.path.abspath(dbpath)}
+    for repo in repos:
+        try:
+            st = os.stat(os.path.join(dbpath, "sync", f"{repo}.db"))
+            stamp[repo] = [st.st_mtime_ns, st.st_size]
+        except FileNotFoundError:
+            pass
+    return stamp
+
+
+def load_dep_index(dbpath=X86_DBPATH, repos=X86_REPOS):
+    """
+    {base: [names and provides, depends and makedepends, checkdepends]} of
+    the x86 sync dbs, cached in DEPS_CACHE until a db changes.
+    """
+    stamp = db_stamp(dbpath, repos)
+    try:
+        with open(DEPS_CACHE, 'r') as f:
+            cache = json.load(f)
+        if cache["stamp"] == stamp:
+            return cache["bases"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    import syncdb
+    bases = {}
+    for db in syncdb.load_dbs(dbpath, repos).values():
+        for pkg in db.pkgcache:
+            entry = bases.setdefault(pkg.base, [[pkg.base], set(), set()])
+            entry[0].extend(re.split(r"[<>=]", name, 1)[0] for name in [pkg.name, *pkg.provides])
+            entry[1].update(re.split(r"[<>=]", dep, 1)[0] for dep in pkg.depends + pkg.makedepends)
+            entry[2].update(re.split(r"[<>=]", dep, 1)[0] for dep in pkg.checkdepends)
+    bases = {base: [list(dict.fromkeys(names[1:])), sorted(deps), sorted(checks)]
+             for base, (names, deps, checks) in bases.items()}
+
+    try:
+        os.makedirs(os.path.dirname(DEPS_CACHE), exist_ok=True)
+        # A file of its own, other builders may be writing the cache too
+        fd, tmp = tempfile.mkstemp(prefix=".eta-deps.", dir=os.path.dirname(DEPS_CACHE))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"stamp": stamp, "bases": bases}, f)
+            os.replace(tmp, DEPS_CACHE)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    except OSError as e:
+        print(f"Failed to save cache {DEPS_CACHE}: {e}", file=sys.stderr)
+    return bases
+
+
+def link_dependencies(tasks, dbpath=X86_DBPATH, repos=X86_REPOS):
+    """Adds the dependencies between queued tasks, from the x86 sync dbs."""
+    queued = {task.base: task for task in tasks if not task.pkgbase.startswith('%')}
+    if not os.path.exists(os.path.join(dbpath, "sync")):
+        print(f"No sync dbs in {dbpath}, ignoring dependencies", file=sys.stderr)
+        return
+
+    index = load_dep_index(dbpath, repos)
+    providers = {}
+    for base, (names, _, _) in index.items():
+        if base in queued:
+            for name in names:
+                providers.setdefault(name, base)
+
+    for base, task in queued.items():
+        if base not in index:
+            continue
+        _, depends, checkdepends = index[base]
+        for name in depends + ([] if task.nocheck else checkdepends):
+            dep = queued.get(providers.get(name))
+            # Only earlier tasks: the queue order already settles cycles
+            if dep is not None and dep.index < task.index:
+                task.deps.add(dep)
+
+    # Commands wait for everything before them, and hold back everything after
+    barrier = None
+    for task in tasks:
+        if task.pkgbase.startswith('%'):
+            task.deps.update(t for t in tasks[barrier.index if barrier else 0:task.index])
+            barrier = task
+        elif barrier is not None:
+            task.deps.add(barrier)
+
+
+def simulate(tasks, builders, now=0.0):
+    """Runs the queue on builders ({name: time_scale}), returns the summary."""
+    for task in tasks:
+        task.dependents = []
+        task.start = task.end = task.builder = task.after = None
+    for task in tasks:
+        for dep in task.deps:
+            dep.dependents.append(task)
+    waiting = {task: len(task.deps) for task in tasks}
+    ready = [task.index for task in tasks if not task.deps and not task.building]
+    heapq.heapify(ready)
+
+    busy = {name: 0.0 for name in builders}
+    count = {name: 0 for name in builders}
+    last = {name: None for name in builders}
+    idle = [(-scale, name) for name, scale in builders.items()]
+    heapq.heapify(idle)
+    running = []
+    clock = now
+
+    def run(task, name, at):
+        task.builder, task.start = name, at
+        task.end = at + task.duration(builders[name])
+        busy[name] += task.end - at
+        count[name] += 1
+        # Whatever finished last before the start held this task back
+        reasons = [] if task.building else [(dep.end, dep, "depends") for dep in task.deps]
+        if last[name] is not None:
+            reasons.append((last[name].end, last[name], "builder"))
+        if reasons:
+            end, prev, kind = max(reasons, key=lambda r: r[0])
+            if end >= at:
+                task.after = (prev, kind)
+        last[name] = task
+        heapq.heappush(running, (task.end, task.index, name))
+
+    # Tasks already building hold the fastest builders first, any left over go first
+    for task in tasks:
+        if task.building:
+            if idle:
+                run(task, heapq.heappop(idle)[1], now)
+            else:
+                heapq.heappush(ready, task.index)
+
+    finished = 0
+    while finished < len(tasks):
+        while ready and idle:
+            run(tasks[heapq.heappop(ready)], heapq.heappop(idle)[1], clock)
+        if not running:
+            break
+        clock, index, name = heapq.heappop(running)
+        finished += 1
+        heapq.heappush(idle, (-builders[name], name))
+        for dependent in tasks[index].dependents:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0 and not dependent.building:
+                heapq.heappush(ready, dependent.index)
+
+    makespan = clock - now
+    chain = []
+    task = max((t for t in tasks if t.end is not None), key=lambda t: t.end, default=None)
+    while task is not None:
+        prev, kind = task.after or (None, None)
+        chain.append({"pkgbase": task.pkgbase, "builder": task.builder, "start": task.start - now,
+                      "end": task.end - now, "after": kind})
+        task = prev
+    chain.reverse()
+
+    return {
+        "tasks": len(tasks),
+        "unscheduled": [task.pkgbase for task in tasks if task.end is None],
+        "expected_failures": round(sum(task.fail for task in tasks), 1),
+        "makespan": makespan,
+        "builders": {name: {"time_scale": builders[name], "tasks": count[name], "busy": busy[name],
+                            "utilization": busy[name] / makespan if makespan else 0.0}
+                     for name in builders},
+        "critical_chain": chain,
+    }
+
+
+def estimate(db_manager, tasklist, builder_names=None, dbpath=X86_DBPATH):
+    start = time.perf_counter()
+    with db_manager.transaction() as cursor:
+        tasks = load_tasks(cursor, tasklist)
+        builders = load_builders(cursor, builder_names)
+    if not builders:
+        raise ValueError("no builders registered")
+    link_dependencies(tasks, dbpath)
+    result = simulate(tasks, builders)
+    result["finish"] = datetime.fromtimestamp(time.time() + result["makespan"]).isoformat(timespec="seconds")
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+def hms(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def print_estimate(result):
+    if not result["tasks"]:
+        print("No remaining tasks.")
+        return
+    print(f"ETA: {hms(result['makespan'])}, finishing at {result['finish']} "
+          f"({result['tasks']} tasks, {result['expected_failures']} expected to fail)")
+    print("Builders:")
+    for name, stat in result["builders"].items():
+        print(f"  {name:16} {stat['tasks']:5} tasks  busy {hms(stat['busy'])}  {stat['utilization']:6.1%}")
+    print("Critical chain:")
+    for link in result["critical_chain"]:
+        via = f"  (after {link['after']})" if link["after"] else ""
+        print(f"  {hms(link['start'])} - {hms(link['end'])}  {link['pkgbase']:34} {link['builder']}{via}")
+    if result["unscheduled"]:
+        print(f"Not scheduled: {' '.join(result['unscheduled'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Project when a build queue finishes.")
+    parser.add_argument("--list", type=int, default=1, help="Tasklist to simulate")
+    parser.add_argument("--builders", type=str, help="Builders to simulate, comma separated; all registered by default")
+    parser.add_argument("--dbpath", default=X86_DBPATH, help="pacman dbpath of the x86 sync dbs for dependencies")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = parser.parse_args()
+
+    with dbcmd.DatabaseManager() as db_manager:
+        try:
+            result = estimate(db_manager, args.list, args.builders and args.builders.split(','), args.dbpath)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+    if args.json:
+        print(json.dumps(result, indent=1))
+    else:
+        print_estimate(result)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Moves packages from one repo to another, the python port of move-repo.sh.
+
+Both repo dbs (.db and .files) are read into memory once. Every move is
+applied to them there and each one is written back once, to a temp file
+renamed over the old db. Entries are taken over from the source db as they
+are, so a package file is only read when the source db doesn't have it.
+The package files and pool symlinks are placed in the same pass. Both dbs
+are locked like repo-add does for the whole move.
+
+Run it in the directory of the packages, like move-repo.sh:
+
+    moverepo.py <repo> [files...]
+    moverepo.py --plan <plan.json>      (saved by compare86.py -m --plan)
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+import syncdb
+
+REPODIR = "/srv/http/loongarch"
+POOL_LINK = "../../../pool/packages"
+# Seconds to wait for a repo-add holding the lock of a db
+LOCK_WAIT = 60
+
+# Desc fields in the order repo-add writes them, with their .PKGINFO keys
+DESC_FIELDS = [
+    ("FILENAME", None), ("NAME", "pkgname"), ("BASE", "pkgbase"), ("VERSION", "pkgver"),
+    ("DESC", "pkgdesc"), ("GROUPS", "group"), ("CSIZE", None), ("ISIZE", "size"),
+    ("SHA256SUM", None), ("PGPSIG", None), ("URL", "url"), ("LICENSE", "license"),
+    ("ARCH", "arch"), ("BUILDDATE", "builddate"), ("PACKAGER", "packager"),
+    ("REPLACES", "replaces"), ("CONFLICTS", "conflict"), ("PROVIDES", "provides"),
+    ("DEPENDS", "depend"), ("OPTDEPENDS", "optdepend"), ("MAKEDEPENDS", "makedepend"),
+    ("CHECKDEPENDS", "checkdepend"),
+]
+
+
+class Entry:
+    """One package of a repo db: its entry directory and the members in .db and .files."""
+
+    def __init__(self, dirname, db, files):
+        self.dirname = dirname
+        self.db = db
+        self.files = files
+
+    def field(self, key):
+        values = syncdb.parse_desc(self.db.get("desc", b"").decode("utf-8", "replace")).get(key)
+        return values[0] if values else None
+
+
+class RepoDB:
+    """The .db and .files tarballs of a repo, held in memory and written back once."""
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.changed = False
+        db = self._read("db")
+        files = self._read("files")
+        self.entries = {}
+        for dirname, members in db.items():
+            entry = Entry(dirname, members, files.get(dirname, {}))
+            name = entry.field("NAME")
+            if name:
+                self.entries[name] = entry
+
+    def path(self, kind):
+        return os.path.join(self.directory, f"{self.name}.{kind}.tar.gz")
+
+    def _read(self, kind):
+        entries = {}
+        if not os.path.exists(self.path(kind)):
+            return entries
+        with open(self.path(kind), "rb") as raw:
+            fileobj, mode = syncdb.open_stream(raw)
+            with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+                for member in tar:
+                    if member.isfile():
+                        dirname, _, kind = member.name.rpartition("/")
+                        entries.setdefault(dirname, {})[kind] = tar.extractfile(member).read()
+        return entries
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def add(self, entry):
+        """Adds entry, returns the file name of the package it replaces."""
+        old = self.remove(entry.field("NAME"))
+        self.entries[entry.field("NAME")] = entry
+        self.changed = True
+        return old
+
+    def remove(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return None
+        self.changed = True
+        return entry.field("FILENAME")
+
+    def _write(self, kind):
+        now = time.time()
+        fd, tmp = tempfile.mkstemp(prefix=f".{self.name}.{kind}.", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f, tarfile.open(fileobj=f, mode="w:gz", compresslevel=6) as tar:
+                for name in sorted(self.entries):
+                    entry = self.entries[name]
+                    info = tarfile.TarInfo(entry.dirname)
+                    info.type, info.mode, info.mtime = tarfile.DIRTYPE, 0o755, now
+                    tar.addfile(info)
+                    for member, data in getattr(entry, kind).items():
+                        info = tarfile.TarInfo(f"{entry.dirname}/{member}")
+                        info.size, info.mode, info.mtime = len(data), 0o644, now
+                        tar.addfile(info, io.BytesIO(data))
+            os.chmod(tmp, 0o664)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        # Keep the previous db as .old like repo-add, readers see the old or the new one
+        path = self.path(kind)
+        if os.path.exists(path):
+            if os.path.lexists(path + ".old"):
+                os.remove(path + ".old")
+            os.link(path, path + ".old")
+        os.replace(tmp, path)
+        link = os.path.join(self.directory, f"{self.name}.{kind}")
+        if not os.path.lexists(link):
+            os.symlink(os.path.basename(path), link)
+
+    def save(self):
+        if not self.changed:
+            return
+        self._write("db")
+        self._write("files")
+        self.changed = False
+
+
+def package_entry(path, filename):
+    """Builds the db entry of a package file the way repo-add --include-sigs does."""
+    pkginfo = {}
+    paths = []
+    with open(path, "rb") as raw:
+        fileobj, mode = syncdb.open_stream(raw)
+        with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+            for member in tar:
+                if member.name == ".PKGINFO":
+                    for line in tar.extractfile(member).read().decode("utf-8", "replace").splitlines():
+                        key, sep, value = line.partition(" = ")
+                        if sep and not key.startswith("#"):
+                            pkginfo.setdefault(key, []).append(value)
+                elif not member.name.startswith("."):
+                    paths.append(member.name + ("/" if member.isdir() else ""))
+
+    with open(path, "rb") as f:
+        computed = {"FILENAME": [filename], "CSIZE": [str(os.fstat(f.fileno()).st_size)],
+                    "SHA256SUM": [hashlib.sha256(f.read()).hexdigest()]}
+    if os.path.exists(path + ".sig"):
+        with open(path + ".sig", "rb") as f:
+            computed["PGPSIG"] = [base64.b64encode(f.read()).decode()]
+
+    desc = ""
+    for key, pkginfo_key in DESC_FIELDS:
+        values = computed.get(key) if pkginfo_key is None else pkginfo.get(pkginfo_key)
+        if values:
+            desc += f"%{key}%\n" + "\n".join(values) + "\n\n"
+    name, version = pkginfo["pkgname"][0], pkginfo["pkgver"][0]
+    desc = desc.encode()
+    files = ("%FILES%\n" + "".join(p + "\n" for p in paths)).encode()
+    return Entry(f"{name}-{version}", {"desc": desc}, {"desc": desc, "files": files})
+
+
+def source_entry(source, filename, path):
+    """The entry of filename in the source db, if it describes this very file."""
+    entry = source.get(filename.rsplit("-", 3)[0]) if source else None
+    if entry is None or "files" not in entry.files or entry.field("FILENAME") != filename:
+        return None
+    if entry.field("CSIZE") != str(os.path.getsize(path)):
+        return None
+    return entry
+
+
+def lock_db(path):
+    """
+    Takes the lock repo-add takes on the db at path, waiting up to LOCK_WAIT
+    seconds for another holder. Returns the lock file, or None.
+    """
+    lockfile = path + ".lck"
+    deadline = time.monotonic() + LOCK_WAIT
+    while True:
+        try:
+            fd = os.open(lockfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            if time.monotonic() < deadline:
+                time.sleep(1)
+                continue
+            try:
+                with open(lockfile) as f:
+                    holder = f.read().strip()
+            except FileNotFoundError:
+                continue
+            print(f"Failed to acquire lockfile: {lockfile}. Held by process {holder}", file=sys.stderr)
+            return None
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{os.getpid()}\n")
+        return lockfile
+
+
+def copy_link(src, dst):
+    if os.path.lexists(dst):
+        os.remove(dst)
+    os.symlink(os.readlink(src), dst)
+
+
+def move(srcdir, to, files, repodir):
+    """Moves files in srcdir to repo to, returns the number of packages moved."""
+    src_name = os.path.basename(srcdir.rstrip("/").removesuffix("/os/loong64"))
+    if "/" in to:
+        new_path = new_repo = os.path.join(to, "os", "loong64")
+        to = os.path.basename(to.rstrip("/"))
+    else:
+        new_repo = os.path.join(repodir, "archlinux", to, "os", "loong64")
+        new_path = os.path.join(repodir, "archlinux", "pool", "packages")
+
+    if os.path.realpath(new_path) == os.path.realpath(srcdir):
+        print("The paths refer to the same directory.", file=sys.stderr)
+        return -1
+    if not os.path.isdir(new_path):
+        print("Destination path don't exist!", file=sys.stderr)
+        return -1
+    if not files:
+        files = sorted(f for f in os.listdir(srcdir) if f.endswith(".zst"))
+    if not files:
+        return 0
+
+    # Held from reading the dbs until they are replaced, so repo-add can't run in between
+    src_db = os.path.join(srcdir, f"{src_name}.db.tar.gz")
+    locks = []
+    try:
+        for db in [os.path.join(new_repo, f"{to}.db.tar.gz")] + ([src_db] if os.path.exists(src_db) else []):
+            lockfile = lock_db(db)
+            if lockfile is None:
+                return -1
+            locks.append(lockfile)
+
+        source = RepoDB(srcdir, src_name) if os.path.exists(src_db) else None
+        target = RepoDB(new_repo, to)
+        moved, stale = [], []
+        for f in files:
+            path = os.path.join(srcdir, f)
+            if not os.path.exists(path + ".sig"):
+                print(f"Signing {f} ...")
+                subprocess.run(["gpg", "--detach-sign", path], check=True)
+            for name in (f, f + ".sig"):
+                if not os.path.islink(os.path.join(srcdir, name)):
+                    os.chmod(os.path.join(srcdir, name), 0o664)
+
+            entry = source_entry(source, f, path) or package_entry(path, f)
+
+            print(f"Copying file: {f} ...")
+            if os.path.islink(path):
+                for name in (f, f + ".sig"):
+                    copy_link(os.path.join(srcdir, name), os.path.join(new_repo, name))
+            elif os.path.exists(os.path.join(new_path, f)):
+                print(f"{f} already there, ignore it.", file=sys.stderr)
+                continue
+            else:
+                for name in (f, f + ".sig"):
+                    shutil.copy(os.path.join(srcdir, name), os.path.join(new_path, name))
+                    if new_path != new_repo:
+                        link = os.path.join(new_repo, name)
+                        if os.path.lexists(link):
+                            os.remove(link)
+                        os.symlink(os.path.join(POOL_LINK, name), link)
+
+            old = target.add(entry)
+            if old and old != f:
+                stale.append(old)
+            moved.append(f)
+
+        if not moved:
+            return 0
+        # The target first: a failure in between leaves packages in both repos, not in none
+        target.save()
+        if source:
+            for f in moved:
+                source.remove(f.rsplit("-", 3)[0])
+            source.save()
+
+        for old in stale:
+            print(f"Deleting {old} ...")
+            for directory in {new_repo, new_path}:
+                for name in (old, old + ".sig"):
+                    if os.path.lexists(os.path.join(directory, name)):
+                        os.remove(os.path.join(directory, name))
+        for f in moved:
+            print(f"Deleting file: {f} ...")
+            for name in (f, f + ".sig"):
+                os.remove(os.path.join(srcdir, name))
+        return len(moved)
+    finally:
+        for lockfile in locks:
+            os.remove(lockfile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move packages of the current directory to another repo.")
+    parser.add_argument("repo", nargs="?", help="Target repo name, or the path of a repo outside the repo dir")
+    parser.add_argument("files", nargs="*", help="Package files to move, all *.zst by default")
+    parser.add_argument("--plan", type=str, help="Do the moves saved by compare86.py -m --plan")
+    parser.add_argument("-d", "--repodir", default=REPODIR, help="Base directory of the repos")
+    args = parser.parse_args()
+
+    if not args.plan and not args.repo:
+        parser.error("a repo or --plan is needed")
+    os.umask(0o002)
+
+    if args.plan:
+        with open(args.plan, 'r') as f:
+            plan = json.load(f)
+        for group in plan:
+            srcdir = os.path.join(args.repodir, "archlinux", group["from"], "os", "loong64")
+            print(f"Moving {len(group['packages'])} packages from {group['from']} to {group['to']}")
+            if move(srcdir, group["to"], [pkg["filename"] for pkg in group["packages"]], args.repodir) < 0:
+                sys.exit(1)
+        return
+
+    start = time.perf_counter()
+    count = move(os.getcwd(), args.repo, args.files, args.repodir)
+    if count < 0:
+        sys.exit(1)
+    print(f"Moved {count} packages in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -2,7 +2,9 @@
 import sys
 import re
 import os
+import costmodel
 import dbcmd
+import perfstat
 
 LOG_KEY_TO_FLAG = {
     'patch': dbcmd.PkgFlags.PATCH,
@@ -38,8 +40,12 @@ ERROR_PATTERNS = [
     (9,  r"\x1b.*==> ERROR:.*\[1m A failure occurred in check"),
     (10, r"\x1b.*==> ERROR:.*\[1m A failure occurred in package"),
     (11, "configure: error: cannot guess build type;"),
+    (12, r"\x1b.*==>.*\[1m Fail to publish"),
 ]
+# Built fine, but publish.py could not get the packages into the repo
+PUBLISH_ERROR = 12
 
+@perfstat.timed()
 def parse_build_log(log_path):
     """
     Parses the log file to extract flags, error stage, builder name, and time cost.
@@ -77,6 +83,12 @@ def parse_build_log(log_path):
                     if re.search(err, line):
                         fail_stage = idx
 
+            if fail_stage == PUBLISH_ERROR:
+                found_flags['fail'] = 1
+
+            if perfstat.ENABLED:
+                perfstat.add("log.bytes", log_file.buffer.tell())
+
             # Parse the footer line for builder stats
             # Looks like: "[built|failed] on <buildername>, time cost: <seconds>"
             match = re.search(r'(?:built|failed) on (\w+), time cost: (\d+)', line)
@@ -90,6 +102,7 @@ def parse_build_log(log_path):
         print(f"Error: File '{log_path}' not found.", file=sys.stderr)
         return None, -1, "", 0
 
+@perfstat.timed()
 def get_logversion(filepath):
     """Extracts package version from the log header."""
     pattern = re.compile(r'\x1b.*==>.*\[1m Making package: (\S+) (\S+)')
@@ -105,6 +118,7 @@ def get_logversion(filepath):
         pass
     return 'no_pkg_version_found', 'null'
 
+@perfstat.timed()
 def update_database_from_log(db_manager, pkgbase, add_bits, rm_bits, builder_name, raw_time, log_ver):
     """
     Performs all database updates in a single transaction.
@@ -123,8 +137,6 @@ def update_database_from_log(db_manager, pkgbase, add_bits, rm_bits, builder_nam
                 if res[1] is not None:
                     scale = res[1]
 
-            final_timecost = raw_time * scale
-
             # 2. Update Package Flags and Timecost
             cursor.execute("SELECT flags FROM packages WHERE base = %s FOR UPDATE", (pkgbase,))
             res = cursor.fetchone()
@@ -133,10 +145,14 @@ def update_database_from_log(db_manager, pkgbase, add_bits, rm_bits, builder_nam
                 current_flags = res[0] or 0
                 new_flags = (current_flags & ~rm_bits) | add_bits
 
-                cursor.execute(
-                    "UPDATE packages SET flags=%s, timecost=%s WHERE base=%s",
-                    (new_flags, final_timecost, pkgbase)
-                )
+                # Only successful builds say how long a build takes
+                final_timecost = None
+                if not add_bits & dbcmd.PkgFlags.FAIL and raw_time > 0:
+                    final_timecost = costmodel.record(cursor, pkgbase, raw_time * scale)
+                    cursor.execute("UPDATE packages SET flags=%s, timecost=%s WHERE base=%s",
+                                   (new_flags, final_timecost, pkgbase))
+                else:
+                    cursor.execute("UPDATE packages SET flags=%s WHERE base=%s", (new_flags, pkgbase))
 
                 # 3. Update Log Version if applicable
                 if log_ver:
@@ -148,8 +164,8 @@ def update_database_from_log(db_manager, pkgbase, add_bits, rm_bits, builder_nam
 
             # 4. Insert into Logs
             cursor.execute(
-                "INSERT INTO logs (pkgbase, builder, build_result) VALUES (%s, %s, %s)",
-                (pkgbase, builder_id, add_bits)
+                "INSERT INTO logs (pkgbase, builder, build_result, duration) VALUES (%s, %s, %s, %s)",
+                (pkgbase, builder_id, add_bits, raw_time)
             )
 
     except Exception as e:
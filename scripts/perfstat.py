@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Opt-in timing for the python scripts.
+
+Set LOONGSHOT_PERF to a file name and every script that imports this module
+appends one JSON line to it when it exits:
+
+    {"script": ..., "argv": [...], "wall": seconds, "cpu": seconds,
+     "phases": {name: {"count", "wall", "cpu"}},
+     "latency": {name: {"count", "total", "max", "histogram": {"<=ms": n}}},
+     "counters": {name: n}}
+
+With LOONGSHOT_PERF unset, timed() returns the function unchanged and
+phase() returns a shared no-op context, so the scripts pay nothing for it.
+"""
+
+import atexit
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+ENV_VAR = "LOONGSHOT_PERF"
+SIDECAR = os.environ.get(ENV_VAR)
+ENABLED = bool(SIDECAR)
+
+# Upper bounds of the latency buckets, in milliseconds
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000]
+
+_phases = defaultdict(lambda: {"count": 0, "wall": 0.0, "cpu": 0.0})
+_latency = defaultdict(lambda: {"count": 0, "total": 0.0, "max": 0.0,
+                                "histogram": {str(b): 0 for b in BUCKETS + ["inf"]}})
+_counters = defaultdict(int)
+_start = (time.perf_counter(), time.process_time())
+_null = contextlib.nullcontext()
+
+
+class _Phase:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        stat = _phases[self.name]
+        stat["count"] += 1
+        stat["wall"] += time.perf_counter() - self.wall
+        stat["cpu"] += time.process_time() - self.cpu
+        return False
+
+
+def phase(name):
+    """Context manager adding its wall and CPU time to the named phase."""
+    return _Phase(name) if ENABLED else _null
+
+
+def timed(name=None):
+    """Decorator timing every call of a function as a phase."""
+    def decorate(func):
+        if not ENABLED:
+            return func
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Phase(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def observe(name, seconds):
+    """Adds one latency sample to the named histogram."""
+    stat = _latency[name]
+    stat["count"] += 1
+    stat["total"] += seconds
+    stat["max"] = max(stat["max"], seconds)
+    ms = seconds * 1000
+    bucket = next((str(b) for b in BUCKETS if ms <= b), "inf")
+    stat["histogram"][bucket] += 1
+
+
+def add(name, n=1):
+    _counters[name] += n
+
+
+def report():
+    return {
+        "script": os.path.basename(sys.argv[0]),
+        "argv": sys.argv[1:],
+        "pid": os.getpid(),
+        "time": time.time(),
+        "wall": time.perf_counter() - _start[0],
+        "cpu": time.process_time() - _start[1],
+        "phases": dict(_phases),
+        "latency": dict(_latency),
+        "counters": dict(_counters),
+    }
+
+
+def _flush():
+    try:
+        with open(SIDECAR, 'a') as f:
+            f.write(json.dumps(report()) + "\n")
+    except OSError as e:
+        print(f"Failed to write {ENV_VAR} file {SIDECAR}: {e}", file=sys.stderr)
+
+
+if ENABLED:
+    atexit.register(_flush)
+
+
+def main():
+    """Summarize a sidecar file: total time of each phase per script."""
+    if len(sys.argv) != 2:
+        print(f"Usage: {sys.argv[0]} <sidecar>")
+        sys.exit(1)
+
+    totals = defaultdict(lambda: defaultdict(lambda: [0, 0.0, 0.0]))
+    with open(sys.argv[1], 'r') as f:
+        for line in f:
+            run = json.loads(line)
+            script = totals[run["script"]]
+            script["(total)"][0] += 1
+            script["(total)"][1] += run["wall"]
+            script["(total)"][2] += run["cpu"]
+            for name, stat in run["phases"].items():
+                script[name][0] += stat["count"]
+                script[name][1] += stat["wall"]
+                script[name][2] += stat["cpu"]
+            for name, stat in run["latency"].items():
+                script[name][0] += stat["count"]
+                script[name][1] += stat["total"]
+
+    for script, phases in totals.items():
+        print(script)
+        for name, (count, wall, cpu) in sorted(phases.items(), key=lambda p: -p[1][1]):
+            print(f"  {name:24} {count:8} {wall:10.3f}s wall {cpu:10.3f}s cpu")
+
+if __name__ == "__main__":
+    main()
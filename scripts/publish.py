@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Publishes built packages to the local repos in batches.
+
+`publish.py add` queues the packages of one build in the spool directory,
+then drains the queue: whoever holds the lock publishes every job waiting
+at that moment, so builds finishing together share one round of
+
+    fetch     one rsync per builder
+    sign      one upload, one signing session and one download on the signing host;
+              packages built on the signing host are signed in place before fetching
+    repo-add  one repo-add per repo db for all its packages
+
+and `add` returns once its own job is published. A failure only fails the
+builds it concerns, which go to spool/failed; a repo db whose repo-add
+failed is put back as it was, packages included. `publish.py run` drains
+the queue in a loop.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import perfstat
+import syncdb
+
+SPOOL = os.path.join(os.path.expanduser("~"), ".cache", "publish")
+SIGN_HOST = os.environ.get("SIGNHOST", "loong1")
+SIGN_DIR = "/mnt/repos"
+# Host name meaning "this machine", so no ssh or rsync over the network
+LOCAL = "local"
+
+
+class Job:
+    """The packages of one build and where they go."""
+
+    def __init__(self, path, builder, builddir, repo, db, files, debug=None, debug_pool=None, **_):
+        self.path = path
+        self.builder = builder
+        self.builddir = builddir
+        self.repo = repo
+        self.db = db
+        self.files = files
+        self.debug = debug
+        self.debug_pool = debug_pool
+        # Signed on the builder, the .sig files come along when fetching
+        self.signed = False
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    def all_files(self):
+        return self.files + ([self.debug] if self.debug else [])
+
+
+def remote(host, path):
+    return path if host == LOCAL else f"{host}:{path}"
+
+
+def run_on(host, command):
+    args = ["sh", "-c", command] if host == LOCAL else ["ssh", host, command]
+    subprocess.run(args, check=True)
+
+
+def enqueue(spool, builder, builddir, repo, db, files, debug=None, debug_pool=None):
+    os.makedirs(spool, exist_ok=True)
+    job = {"builder": builder, "builddir": builddir, "repo": repo, "db": db,
+           "files": files, "debug": debug, "debug_pool": debug_pool}
+    fd, path = tempfile.mkstemp(prefix=f"{int(time.time() * 1000)}-", suffix=".json", dir=spool)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(job, f)
+    return path
+
+
+def load_jobs(spool, limit=None):
+    jobs = []
+    for name in sorted(os.listdir(spool)):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(spool, name)
+        try:
+            with open(path, 'r') as f:
+                jobs.append(Job(path, **json.load(f)))
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Skipping bad job {name}: {e}", file=sys.stderr)
+        if limit and len(jobs) >= limit:
+            break
+    return jobs
+
+
+def sign_loop(files):
+    # Debug packages are optional, the others are checked after fetching
+    return ("for f in " + " ".join(files) +
+            "; do [ -f $f ] || continue; rm -f $f.sig; gpg --detach-sign $f || exit 1; done")
+
+
+def sign_in_place(jobs, sign_host):
+    """Signs the packages of jobs built on the signing host in their build directories, in one session."""
+    if not jobs:
+        return
+    run_on(sign_host, " && ".join(f"cd {job.builddir} && {sign_loop(job.all_files())}" for job in jobs))
+    for job in jobs:
+        job.signed = True
+
+
+def fetch(jobs, staging):
+    """
+    Copies the packages of all jobs to staging, one rsync per builder.
+    Returns {builder: error} of the builders that could not be fetched from.
+    """
+    by_builder = {}
+    for job in jobs:
+        files = job.all_files() + ([f + ".sig" for f in job.all_files()] if job.signed else [])
+        by_builder.setdefault(job.builder, []).extend(os.path.join(job.builddir, f) for f in files)
+    errors = {}
+    for builder, paths in by_builder.items():
+        # Debug packages are optional, so missing files are not an error here
+        try:
+            subprocess.run(["rsync", "-a", "--no-relative", "--ignore-missing-args", "--files-from=-",
+                            remote(builder, "/"), staging + "/"],
+                           input="\n".join(paths) + "\n", text=True, check=True)
+        except subprocess.CalledProcessError as e:
+            errors[builder] = e
+    return errors
+
+
+def sign(files, staging, sign_host, sign_dir):
+    """Signs files in staging in one session on the signing host."""
+    if not files:
+        return
+    if sign_host == LOCAL:
+        run_on(LOCAL, f"cd {staging} && {sign_loop(files)}")
+        return
+    workdir = f"{sign_dir}/publish-{os.getpid()}"
+    run_on(sign_host, f"mkdir -p {workdir}")
+    try:
+        subprocess.run(["rsync", "-a", *[os.path.join(staging, f) for f in files], remote(sign_host, workdir + "/")],
+                       check=True)
+        run_on(sign_host, f"cd {workdir} && {sign_loop(files)}")
+        subprocess.run(["rsync", "-a", "--include=*.sig", "--exclude=*", remote(sign_host, workdir + "/"), staging + "/"],
+                       check=True)
+    finally:
+        run_on(sign_host, f"rm -rf {workdir}")
+
+
+def db_filenames(path):
+    """{pkgname: file name} of the packages in a repo db."""
+    names, _, _, descs = syncdb.read_db(path)
+    return {name: syncdb.desc_field(desc, "FILENAME") for name, desc in zip(names, descs)}
+
+
+def install(repo, db, jobs, staging):
+    """
+    Moves the signed packages of jobs into repo and adds them to db with one
+    repo-add. Either all of them are published or, if anything fails,
+    the repo and db are put back as they were and the error is raised.
+    """
+    files = [f for job in jobs for f in job.files]
+    db_path = os.path.join(repo, db)
+    dbs = [db_path, os.path.join(repo, db.replace(".db.", ".files.", 1))]
+    old = db_filenames(db_path)
+    backup = os.path.join(staging, "backup")
+    os.makedirs(backup, exist_ok=True)
+
+    # repo-add writes a new db and renames it over the old one, so links keep the old ones
+    saved = []
+    for path in dbs:
+        if os.path.exists(path):
+            os.link(path, os.path.join(backup, os.path.basename(path)))
+            saved.append(path)
+    moved = []
+    try:
+        for f in files:
+            for name in (f, f + ".sig"):
+                target = os.path.join(repo, name)
+                if os.path.exists(target):
+                    os.replace(target, os.path.join(backup, name))
+                shutil.move(os.path.join(staging, name), target)
+                moved.append(name)
+                os.chmod(target, 0o664)
+        # Without -R: it would delete the file of an entry replaced by the same
+        # file name, and the old files must stay until the db is in place
+        subprocess.run(["repo-add", db, *files], cwd=repo, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        for name in moved:
+            os.replace(os.path.join(repo, name), os.path.join(staging, name))
+            if os.path.exists(os.path.join(backup, name)):
+                os.replace(os.path.join(backup, name), os.path.join(repo, name))
+        for path in dbs:
+            if path in saved:
+                os.replace(os.path.join(backup, os.path.basename(path)), path)
+            elif os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        for path in saved:
+            if os.path.exists(os.path.join(backup, os.path.basename(path))):
+                os.remove(os.path.join(backup, os.path.basename(path)))
+
+    # Published from here on, so a failure only leaves some files behind
+    try:
+        # What repo-add -R does: delete the files of the versions just replaced
+        for f in files:
+            stale = old.get(f.rsplit("-", 3)[0])
+            if stale and stale not in files:
+                for name in (stale, stale + ".sig"):
+                    if os.path.exists(os.path.join(repo, name)):
+                        os.remove(os.path.join(repo, name))
+
+        for job in jobs:
+            if job.debug and os.path.exists(os.path.join(staging, job.debug)):
+                for name in (job.debug, job.debug + ".sig"):
+                    shutil.move(os.path.join(staging, name), os.path.join(job.debug_pool, name))
+                    os.chmod(os.path.join(job.debug_pool, name), 0o664)
+    except OSError as e:
+        print(f"Warning: published to {db}, but: {e}", file=sys.stderr)
+    return len(files)
+
+
+def fail(job, reason):
+    print(f"Failed to publish {job.name}: {reason}", file=sys.stderr)
+    failed = os.path.join(os.path.dirname(job.path), "failed")
+    os.makedirs(failed, exist_ok=True)
+    os.replace(job.path, os.path.join(failed, job.name))
+
+
+@contextmanager
+def timed(stages, stage):
+    start = time.perf_counter()
+    with perfstat.phase(stage):
+        yield
+    stages[stage] = stages.get(stage, 0.0) + time.perf_counter() - start
+
+
+def publish(jobs, sign_host, sign_dir):
+    """
+    Publishes a batch of jobs, returns the latency of each stage. A failure
+    only fails the jobs it concerns: those of one builder, of one signing
+    session or of one repo db.
+    """
+    stages = {}
+    ready = list(jobs)
+    published = []
+    count = 0
+
+    def drop(failed, reason):
+        for job in failed:
+            fail(job, reason)
+            ready.remove(job)
+
+    parent = os.path.dirname(jobs[0].path)
+    staging = tempfile.mkdtemp(prefix="staging-", dir=parent)
+    try:
+        # Packages built on the signing host are signed where they are
+        in_place = [job for job in ready if job.builder == sign_host]
+        with timed(stages, "sign"):
+            try:
+                sign_in_place(in_place, sign_host)
+            except subprocess.CalledProcessError as e:
+                drop(in_place, e)
+
+        with timed(stages, "fetch"):
+            errors = fetch(ready, staging)
+        for builder, e in errors.items():
+            drop([job for job in ready if job.builder == builder], e)
+        for job in list(ready):
+            names = [name for f in job.files for name in ((f, f + ".sig") if job.signed else (f,))]
+            missing = [name for name in names if not os.path.exists(os.path.join(staging, name))]
+            if missing:
+                drop([job], f"missing {' '.join(missing)}")
+
+        unsigned = [job for job in ready if not job.signed]
+        with timed(stages, "sign"):
+            try:
+                sign([f for job in unsigned for f in job.all_files() if os.path.exists(os.path.join(staging, f))],
+                     staging, sign_host, sign_dir)
+            except (OSError, subprocess.CalledProcessError) as e:
+                drop(unsigned, e)
+
+        groups = {}
+        for job in ready:
+            groups.setdefault((job.repo, job.db), []).append(job)
+        with timed(stages, "repo-add"):
+            for (repo, db), group in groups.items():
+                try:
+                    count += install(repo, db, group, staging)
+                except (OSError, subprocess.CalledProcessError, syncdb.error) as e:
+                    drop(group, e)
+                    continue
+                for job in group:
+                    os.remove(job.path)
+                published.extend(group)
+    except (OSError, subprocess.CalledProcessError) as e:
+        for job in ready:
+            if os.path.exists(job.path):
+                fail(job, e)
+        raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    if not published:
+        return None
+    total = sum(stages.values())
+    print(f"Published {count} packages of {len(published)} builds in {total:.1f}s: " +
+          " ".join(f"{stage} {seconds:.1f}s" for stage, seconds in stages.items()))
+    return {"time": time.time(), "jobs": len(published), "packages": count, "stages": stages}
+
+
+def drain(spool, sign_host, sign_dir, batch, report=None):
+    """Publishes everything queued, holding the spool lock."""
+    os.makedirs(spool, exist_ok=True)
+    with open(os.path.join(spool, ".lock"), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        while True:
+            jobs = load_jobs(spool, batch)
+            if not jobs:
+                return
+            try:
+                result = publish(jobs, sign_host, sign_dir)
+            except (OSError, subprocess.CalledProcessError):
+                continue
+            if result and report:
+                with open(report, 'a') as f:
+                    f.write(json.dumps(result) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish built packages to the local repos in batches.")
+    parser.add_argument("--spool", default=SPOOL, help="Queue directory")
+    parser.add_argument("--sign-host", default=SIGN_HOST, help=f"Host with the signing key, '{LOCAL}' for this one")
+    parser.add_argument("--sign-dir", default=SIGN_DIR, help="Work directory on the signing host")
+    parser.add_argument("--batch", type=int, default=100, help="Most builds to publish at once")
+    parser.add_argument("--report", type=str, help="Append the stage latencies of each batch to this file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Queue the packages of a build and wait until they are published")
+    add_parser.add_argument("--builder", required=True, help=f"Host the packages are on, '{LOCAL}' for this one")
+    add_parser.add_argument("--builddir", required=True, help="Directory of the packages on the builder")
+    add_parser.add_argument("--repo", required=True, help="Local repo directory")
+    add_parser.add_argument("--db", required=True, help="Repo db file name, e.g. temp-extra.db.tar.gz")
+    add_parser.add_argument("--debug", help="Debug package, published to --debug-pool if it was built")
+    add_parser.add_argument("--debug-pool", help="Directory for debug packages")
+    add_parser.add_argument("files", nargs="+", help="Package files")
+
+    run_parser = subparsers.add_parser("run", help="Publish queued builds")
+    run_parser.add_argument("--once", action="store_true", help="Drain the queue once and exit")
+    run_parser.add_argument("--interval", type=int, default=10, help="Seconds between queue checks")
+
+    args = parser.parse_args()
+
+    if args.command == "add":
+        if args.debug and not args.debug_pool:
+            parser.error("--debug needs --debug-pool")
+        path = enqueue(args.spool, args.builder, args.builddir, os.path.abspath(args.repo), args.db,
+                       args.files, args.debug, args.debug_pool and os.path.abspath(args.debug_pool))
+        drain(args.spool, args.sign_host, args.sign_dir, args.batch, args.report)
+        failed = os.path.join(args.spool, "failed", os.path.basename(path))
+        sys.exit(1 if os.path.exists(failed) else 0)
+
+    while True:
+        drain(args.spool, args.sign_host, args.sign_dir, args.batch, args.report)
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
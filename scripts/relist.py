@@ -1,15 +1,19 @@
 #!/usr/bin/env python3
 import os
-import pyalpm
+import json
+import syncdb
 import argparse
 import sys
+import tempfile
 
 home_dir = os.path.expanduser("~")
 cache_dir = os.path.join(home_dir, ".cache", "compare86")
+map_cache = os.path.join(cache_dir, "relist.json")
 
 # Define the repo file paths
 x86_repo_path = "x86"
-x86_repos = ['core', 'extra']
+# Earlier repos win when a name shows up in several of them
+x86_repos = ['core-staging', 'extra-staging', 'core-testing', 'extra-testing', 'core', 'extra']
 
 pkgbase = {}
 pkgname = {}
@@ -17,70 +21,127 @@ pkgname = {}
 whitelist={"mupdf": "libmupdf",
            "libspelling": "libspelling"}
 
-# cache all package buildtime
-def get_pkgbase():
+
+def db_stamp():
+    """mtime and size of every sync db file, to tell when the cache is stale."""
+    stamp = {}
     for repo in x86_repos:
-        x86_db = load_repo(os.path.join(cache_dir, x86_repo_path), repo)
-        for pkg in x86_db.pkgcache:
-            pkgbase[pkg.name] = pkg.base
-            pkgname[pkg.base] = pkg.name
-    for key in whitelist:
-        pkgname[key] = whitelist[key]
+        db_file = os.path.join(cache_dir, x86_repo_path, "sync", f"{repo}.db")
+        try:
+            st = os.stat(db_file)
+            stamp[repo] = [st.st_mtime_ns, st.st_size]
+        except FileNotFoundError:
+            pass
+    return stamp
 
 
-# Load the repository database
-def load_repo(repo_path, repo):
-    handle = pyalpm.Handle("/", repo_path)
+def build_maps():
+    names = {}
+    bases = {}
+    provides = {}
     try:
-        db = handle.register_syncdb(repo, 0)
-        return db
-    except pyalpm.error as e:
-        print(f"Failed to load repo {repo_path}: {e}")
-        return None
+        dbs = syncdb.load_dbs(os.path.join(cache_dir, x86_repo_path), x86_repos)
+    except syncdb.error as e:
+        print(f"Failed to load repos: {e}", file=sys.stderr)
+        dbs = {}
+    for repo in x86_repos:
+        if repo not in dbs:
+            continue
+        for pkg in dbs[repo].pkgcache:
+            names.setdefault(pkg.name, pkg.base)
+            if pkg.name == pkg.base or pkg.base not in bases:
+                bases[pkg.base] = pkg.name
+            for provide in pkg.provides:
+                provides.setdefault(provide.split("=")[0], pkg.base)
+    # Real package names take precedence over provides
+    return {**provides, **names}, bases
 
 
-def read_and_convert_file(file_path, kvp):
-    data = []
-    # Read the file line by line and convert to dict
-    if file_path is None:
-        istream = sys.stdin
-    else:
-        istream = open(file_path, 'r')
-    for line in istream:
+# cache all package buildtime
+def get_pkgbase(refresh=False):
+    stamp = db_stamp()
+    if not refresh:
+        try:
+            with open(map_cache, 'r') as f:
+                cache = json.load(f)
+            if cache["stamp"] == stamp:
+                pkgbase.update(cache["pkgbase"])
+                pkgname.update(cache["pkgname"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    if not pkgbase:
+        names, bases = build_maps()
+        pkgbase.update(names)
+        pkgname.update(bases)
+        try:
+            # A file of its own, other builders may be writing the cache too
+            fd, tmp = tempfile.mkstemp(prefix=".relist.", dir=os.path.dirname(map_cache))
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({"stamp": stamp, "pkgbase": pkgbase, "pkgname": pkgname}, f)
+                os.replace(tmp, map_cache)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        except OSError as e:
+            print(f"Failed to save cache {map_cache}: {e}", file=sys.stderr)
+
+    for key in whitelist:
+        pkgname[key] = whitelist[key]
+
+
+def convert_lines(istream, kvp, unknown):
+    """Yield converted lines, recording names missing from kvp in unknown."""
+    for lineno, line in enumerate(istream, 1):
         line = line.strip()  # Remove leading/trailing spaces
         if line.startswith("--"):
-            data.append(line)
+            yield line
+            continue
+        if not line:  # Skip empty lines
             continue
-        if line:  # Skip empty lines
-            if line.endswith(":nocheck"):
-                pkg = line.split(":")[0]
-                data.append(f"{kvp[pkg]}:nocheck")
-            else:
-                data.append(kvp[line])
+        pkg, nocheck, _ = line.partition(":nocheck")
+        if pkg not in kvp:
+            unknown.append((lineno, pkg))
+            yield line
+            continue
+        yield f"{kvp[pkg]}:nocheck" if nocheck else kvp[pkg]
+
+
+def read_and_convert_file(file_path, kvp):
+    unknown = []
     if file_path is None:
-        for item in data:
+        for item in convert_lines(sys.stdin, kvp, unknown):
             print(item)
     else:
-        istream.close()
+        with open(file_path, 'r') as istream:
+            data = list(convert_lines(istream, kvp, unknown))
         # Write the updated data back to the file
         with open(file_path, 'w') as f:
             for item in data:
                 f.write(f"{item}\n")
 
+    for lineno, pkg in unknown:
+        print(f"Unknown package at line {lineno}: {pkg}", file=sys.stderr)
+    return not unknown
+
 def main():
     parser = argparse.ArgumentParser(description="convert from pkgname to pkgbase and vice versa.")
     parser.add_argument("-b", "--name-to-base", action="store_true", help="From pkgname to pkgbase.")
     parser.add_argument("-n", "--base-to-name", action="store_true", help="From pkgbase to pkgname.")
     parser.add_argument("-f", "--file", type=str, help="The list file to process.")
+    parser.add_argument("-r", "--refresh", action="store_true", help="Rebuild the cached name maps.")
 
     args = parser.parse_args()
 
-    get_pkgbase()
+    get_pkgbase(args.refresh)
 
+    ok = True
     if args.name_to_base:
-        read_and_convert_file(args.file, pkgbase)
+        ok = read_and_convert_file(args.file, pkgbase)
     elif args.base_to_name:
-        read_and_convert_file(args.file, pkgname)
+        ok = read_and_convert_file(args.file, pkgname)
+    sys.exit(0 if ok else 1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Checks the loong repos for inconsistencies and prints them as JSON. Covers
+what loong_lint in compare86.py, checkrepo.sh and findtodel.sh look for, in
+one scandir of each repo directory and of the pool, one read of each db and
+one query of the packages table:
+
+    orphan_files     package files no db entry points to
+    missing_files    db entries without their package file
+    missing_sigs     db entries without a signature
+    version_skew     split packages of one base with different versions
+    dangling_links   symlinks to files that are gone
+    no_x86           packages x86 doesn't have in any repo
+    unreferenced     (pool) files no repo links to
+
+The pool is checked against the links of every repo in the repo dir, also
+the ones left out with -r.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+import syncdb
+
+REPODIR = "/srv/http/loongarch/archlinux"
+REPOS = ['core-staging', 'extra-staging', 'core-testing', 'extra-testing', 'core', 'extra']
+POOL = "pool/packages"
+# Packages only loong has, never reported as missing on x86
+LOONG_ONLY = re.compile(r"loong|x86_64-linux|lcpu|yt6801|linux-4k|edk2-loongarch|musl-x86_64")
+
+
+def scan_dir(path):
+    """{name: symlink target or None} of the files in path, from one scandir."""
+    entries = {}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                entries[entry.name] = os.readlink(entry.path) if entry.is_symlink() else None
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def no_x86_packages():
+    """Names in the packages table with no x86 version in any repo."""
+    import dbcmd
+    with dbcmd.DatabaseManager() as db_manager:
+        with db_manager.transaction() as cursor:
+            cursor.execute("""SELECT name FROM packages WHERE x86_version IS NULL
+                              AND x86_testing_version IS NULL AND x86_staging_version IS NULL""")
+            return {row[0] for row in cursor.fetchall() if not LOONG_ONLY.search(row[0])}
+
+
+def lint_repo(repo, path, pool_dir, pool_files, no_x86, linked):
+    entries = scan_dir(path)
+    db = syncdb.SyncDB(repo, os.path.join(path, f"{repo}.db"))
+    report = defaultdict(list)
+
+    filenames = set()
+    versions = defaultdict(dict)
+    for pkg in db.pkgcache:
+        filenames.add(pkg.filename)
+        versions[pkg.base][pkg.name] = pkg.version
+        if pkg.filename not in entries:
+            report["missing_files"].append(pkg.filename)
+        if pkg.filename + ".sig" not in entries:
+            report["missing_sigs"].append(pkg.filename)
+        if no_x86 is not None and pkg.name in no_x86:
+            report["no_x86"].append(pkg.name)
+
+    for base, names in sorted(versions.items()):
+        if len(set(names.values())) > 1:
+            report["version_skew"].append({"base": base, "versions": names})
+
+    for name, target in sorted(entries.items()):
+        if target is not None:
+            resolved = os.path.normpath(os.path.join(path, target))
+            # Links into the pool are checked against its scan, no stat needed
+            if os.path.dirname(resolved) == pool_dir:
+                linked.add(os.path.basename(resolved))
+                exists = os.path.basename(resolved) in pool_files
+            else:
+                exists = os.path.exists(resolved)
+            if not exists:
+                report["dangling_links"].append(name)
+        if name.endswith(".pkg.tar.zst") and name not in filenames:
+            report["orphan_files"].append(name)
+
+    for key in report:
+        report[key].sort(key=lambda item: item if isinstance(item, str) else item["base"])
+    return dict(report)
+
+
+def pool_links(path, pool_dir):
+    """Names of the pool files linked from the repo directory path."""
+    linked = set()
+    for target in scan_dir(path).values():
+        if target is not None:
+            resolved = os.path.normpath(os.path.join(path, target))
+            if os.path.dirname(resolved) == pool_dir:
+                linked.add(os.path.basename(resolved))
+    return linked
+
+
+def lint(repodir, repos, check_x86=True):
+    start = time.perf_counter()
+    pool_dir = os.path.normpath(os.path.join(repodir, POOL))
+    pool_files = scan_dir(pool_dir)
+    no_x86 = no_x86_packages() if check_x86 else None
+
+    result = {}
+    linked = set()
+    for repo in repos:
+        path = os.path.join(repodir, repo, "os", "loong64")
+        result[repo] = lint_repo(repo, path, pool_dir, pool_files, no_x86, linked)
+    # Pool files count as referenced from any repo, not only the ones checked
+    for repo in sorted(set(scan_dir(repodir)) - set(repos)):
+        linked |= pool_links(os.path.join(repodir, repo, "os", "loong64"), pool_dir)
+    result["pool"] = {"unreferenced": sorted(name for name in pool_files
+                                             if name.endswith((".zst", ".sig")) and name not in linked)}
+    summary = defaultdict(int)
+    for repo, report in result.items():
+        for key, items in report.items():
+            summary[key] += len(items)
+    result["summary"] = dict(summary, elapsed=round(time.perf_counter() - start, 3))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the loong repos for inconsistencies.")
+    parser.add_argument("-d", "--repodir", default=REPODIR, help="Directory holding the repos and the pool")
+    parser.add_argument("-r", "--repos", default=",".join(REPOS), help="Repos to check, separated by comma")
+    parser.add_argument("--no-db", action="store_true", help="Skip the check against the packages table")
+    parser.add_argument("-o", "--output", type=str, help="Save the report to file")
+    args = parser.parse_args()
+
+    result = lint(args.repodir, args.repos.split(","), not args.no_db)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=1)
+            f.write("\n")
+    else:
+        json.dump(result, sys.stdout, indent=1)
+        print()
+    found = sum(v for k, v in result["summary"].items() if k != "elapsed")
+    print(f"{found} problems found in {result['summary']['elapsed']}s", file=sys.stderr)
+    sys.exit(1 if found else 0)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Reads pacman sync dbs without libalpm.
+
+The desc entries are streamed out of the .db archive (gzip, xz, bzip2, zstd
+or plain tar) into per-repo columns: names, bases and versions up front,
+everything else parsed from the raw desc text on first access. Several
+repos are loaded in parallel with load_dbs().
+
+The API is the subset of pyalpm the scripts use, so a script only reading
+the dbs can swap
+
+    handle = pyalpm.Handle("/", path)   ->   handle = syncdb.Handle("/", path)
+
+and keep its pkgcache/get_pkg/search/vercmp calls. It can't download dbs:
+syncing still needs pyalpm.
+"""
+
+import os
+import re
+import sys
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+from signal import signal, SIGPIPE, SIG_DFL
+
+SIG_DATABASE_OPTIONAL = 0
+
+# A dependency string: name, then optionally a comparison and a version
+DEPEND_RE = re.compile(r'^([^<>=]+)(?:(<=|>=|<|>|=)(.+))?$')
+
+# Desc fields holding a list, the others hold one value
+LIST_FIELDS = {
+    "DEPENDS": "depends",
+    "MAKEDEPENDS": "makedepends",
+    "CHECKDEPENDS": "checkdepends",
+    "OPTDEPENDS": "optdepends",
+    "PROVIDES": "provides",
+    "CONFLICTS": "conflicts",
+    "REPLACES": "replaces",
+    "GROUPS": "groups",
+    "LICENSE": "licenses",
+}
+VALUE_FIELDS = {
+    "FILENAME": "filename",
+    "DESC": "desc",
+    "URL": "url",
+    "ARCH": "arch",
+    "PACKAGER": "packager",
+    "SHA256SUM": "sha256sum",
+}
+INT_FIELDS = {
+    "CSIZE": "size",
+    "ISIZE": "isize",
+    "BUILDDATE": "builddate",
+}
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class error(Exception):
+    pass
+
+
+def _zstd_reader(f):
+    try:
+        from compression import zstd
+        return zstd.ZstdFile(f)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise error("reading zstd dbs needs python 3.14 or the zstandard module")
+    return zstandard.ZstdDecompressor().stream_reader(f)
+
+
+def open_stream(raw):
+    """(fileobj, tarfile mode) to stream a tar archive of any compression out of raw."""
+    magic = raw.read(4)
+    raw.seek(0)
+    if magic == ZSTD_MAGIC:
+        return _zstd_reader(raw), "r|"
+    return raw, "r|*"
+
+
+def desc_field(text, key):
+    """The first value of a desc field, without parsing the rest."""
+    start = text.find(f"%{key}%\n")
+    if start < 0:
+        return None
+    start += len(key) + 3
+    end = text.find("\n", start)
+    return text[start:end if end >= 0 else len(text)]
+
+
+def parse_desc(text):
+    fields = {}
+    for block in text.split("\n\n"):
+        lines = block.strip("\n").split("\n")
+        if lines[0].startswith("%") and lines[0].endswith("%"):
+            fields[lines[0][1:-1]] = lines[1:]
+    return fields
+
+
+def read_db(path):
+    """Streams the desc entries of a db file into (names, bases, versions, descs)."""
+    names, bases, versions, descs = [], [], [], []
+    if not os.path.exists(path):
+        return names, bases, versions, descs
+
+    with open(path, "rb") as raw:
+        fileobj, mode = open_stream(raw)
+        try:
+            with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+                entries = {}
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    entry, _, kind = member.name.rpartition("/")
+                    # Old dbs split desc and depends, both go in one text
+                    if kind in ("desc", "depends"):
+                        text = tar.extractfile(member).read().decode("utf-8", "replace")
+                        entries[entry] = entries.get(entry, "") + "\n" + text
+        except (tarfile.TarError, OSError, EOFError) as e:
+            raise error(f"failed to read {path}: {e}")
+
+    for text in entries.values():
+        name = desc_field(text, "NAME")
+        if name is None:
+            continue
+        names.append(name)
+        bases.append(desc_field(text, "BASE") or name)
+        versions.append(desc_field(text, "VERSION") or "")
+        descs.append(text)
+    return names, bases, versions, descs
+
+
+class Package:
+    """One package of a SyncDB. Fields other than name, base and version are parsed on first use."""
+
+    __slots__ = ("db", "_idx")
+
+    def __init__(self, db, idx):
+        self.db = db
+        self._idx = idx
+
+    @property
+    def name(self):
+        return self.db._names[self._idx]
+
+    @property
+    def base(self):
+        return self.db._bases[self._idx]
+
+    @property
+    def version(self):
+        return self.db._versions[self._idx]
+
+    def _fields(self):
+        return self.db._parsed(self._idx)
+
+    def __getattr__(self, attr):
+        if attr in _ATTR_LIST:
+            return list(self._fields().get(_ATTR_LIST[attr], []))
+        if attr in _ATTR_VALUE:
+            values = self._fields().get(_ATTR_VALUE[attr])
+            return values[0] if values else None
+        if attr in _ATTR_INT:
+            values = self._fields().get(_ATTR_INT[attr])
+            return int(values[0]) if values else 0
+        raise AttributeError(attr)
+
+    def __repr__(self):
+        return f"<Package {self.name}-{self.version}>"
+
+
+_ATTR_LIST = {attr: key for key, attr in LIST_FIELDS.items()}
+_ATTR_VALUE = {attr: key for key, attr in VALUE_FIELDS.items()}
+_ATTR_INT = {attr: key for key, attr in INT_FIELDS.items()}
+
+
+class SyncDB:
+    """Packages of one repo, stored as columns."""
+
+    def __init__(self, name, path, columns=None):
+        self.name = name
+        self.path = path
+        self.servers = []
+        self._columns = columns
+        self._index = None
+        self._parsed_cache = {}
+
+    def _load(self):
+        if self._columns is None:
+            self._columns = read_db(self.path)
+        return self._columns
+
+    @property
+    def _names(self):
+        return self._load()[0]
+
+    @property
+    def _bases(self):
+        return self._load()[1]
+
+    @property
+    def _versions(self):
+        return self._load()[2]
+
+    def _parsed(self, idx):
+        fields = self._parsed_cache.get(idx)
+        if fields is None:
+            fields = self._parsed_cache[idx] = parse_desc(self._load()[3][idx])
+        return fields
+
+    @property
+    def pkgcache(self):
+        return [Package(self, i) for i in range(len(self._names))]
+
+    def get_pkg(self, name):
+        if self._index is None:
+            self._index = {}
+            for i, pkgname in enumerate(self._names):
+                self._index.setdefault(pkgname, i)
+        idx = self._index.get(name)
+        return Package(self, idx) if idx is not None else None
+
+    def search(self, *patterns):
+        # Only the match-everything search the scripts use
+        if any(patterns):
+            raise error("syncdb only supports search('')")
+        return self.pkgcache
+
+    @property
+    def grpcache(self):
+        groups = {}
+        for pkg in self.pkgcache:
+            for group in pkg.groups:
+                groups.setdefault(group, []).append(pkg)
+        return sorted(groups.items())
+
+    def read_grp(self, group):
+        pkgs = [pkg for pkg in self.pkgcache if group in pkg.groups]
+        return (group, pkgs) if pkgs else None
+
+    def update(self, force):
+        raise error("syncdb can't download dbs, sync with pyalpm")
+
+
+class Handle:
+    """Stands in for pyalpm.Handle, reading <dbpath>/sync/<repo>.db."""
+
+    def __init__(self, root, dbpath):
+        self.root = root
+        self.dbpath = dbpath
+        self._dbs = []
+
+    def register_syncdb(self, name, flags):
+        db = SyncDB(name, os.path.join(self.dbpath, "sync", f"{name}.db"))
+        self._dbs.append(db)
+        return db
+
+    def get_syncdbs(self):
+        return list(self._dbs)
+
+    def load(self, processes=None):
+        """Reads all registered dbs now, in parallel."""
+        pending = [db for db in self._dbs if db._columns is None]
+        for db, columns in zip(pending, _read_many([db.path for db in pending], processes)):
+            db._columns = columns
+
+
+def _read_many(paths, processes=None):
+    if len(paths) < 2 or processes == 1:
+        return [read_db(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=processes or min(len(paths), os.cpu_count() or 1)) as pool:
+        return list(pool.map(read_db, paths))
+
+
+def load_dbs(dbpath, names, processes=None):
+    """Registers and reads several repos of dbpath in parallel, returns {name: SyncDB}."""
+    handle = Handle("/", dbpath)
+    dbs = {name: handle.register_syncdb(name, SIG_DATABASE_OPTIONAL) for name in names}
+    handle.load(processes)
+    return dbs
+
+
+def _isdigit(c):
+    return "0" <= c <= "9"
+
+
+def _isalpha(c):
+    return "a" <= c <= "z" or "A" <= c <= "Z"
+
+
+def _isalnum(c):
+    return _isdigit(c) or _isalpha(c)
+
+
+def rpmvercmp(a, b):
+    """libalpm's rpmvercmp, segment by segment."""
+    if a == b:
+        return 0
+    one = two = 0
+    ptr1 = ptr2 = 0
+    while one < len(a) and two < len(b):
+        while one < len(a) and not _isalnum(a[one]):
+            one += 1
+        while two < len(b) and not _isalnum(b[two]):
+            two += 1
+        # If we ran to the end of either, we are finished with the loop
+        if one >= len(a) or two >= len(b):
+            break
+        # If the separator lengths were different, we are also finished
+        if one - ptr1 != two - ptr2:
+            return -1 if one - ptr1 < two - ptr2 else 1
+
+        ptr1, ptr2 = one, two
+        # Grab the first completely alpha or completely numeric segment
+        if _isdigit(a[ptr1]):
+            while ptr1 < len(a) and _isdigit(a[ptr1]):
+                ptr1 += 1
+            while ptr2 < len(b) and _isdigit(b[ptr2]):
+                ptr2 += 1
+            isnum = True
+        else:
+            while ptr1 < len(a) and _isalpha(a[ptr1]):
+                ptr1 += 1
+            while ptr2 < len(b) and _isalpha(b[ptr2]):
+                ptr2 += 1
+            isnum = False
+
+        # Numeric segments are always newer than alpha segments
+        if two == ptr2:
+            return 1 if isnum else -1
+
+        seg1, seg2 = a[one:ptr1], b[two:ptr2]
+        if isnum:
+            seg1, seg2 = seg1.lstrip("0"), seg2.lstrip("0")
+            # Whichever number has more digits wins
+            if len(seg1) != len(seg2):
+                return 1 if len(seg1) > len(seg2) else -1
+        if seg1 != seg2:
+            return 1 if seg1 > seg2 else -1
+        one, two = ptr1, ptr2
+
+    # All segments compared identically but the separators were different
+    if one >= len(a) and two >= len(b):
+        return 0
+    # A remaining alpha string never beats an empty string
+    rest1 = a[one] if one < len(a) else ""
+    rest2 = b[two] if two < len(b) else ""
+    if (not rest1 and not _isalpha(rest2)) or _isalpha(rest1):
+        return -1
+    return 1
+
+
+def _parse_evr(evr):
+    i = 0
+    while i < len(evr) and _isdigit(evr[i]):
+        i += 1
+    if i < len(evr) and evr[i] == ":":
+        epoch, rest = evr[:i] or "0", evr[i + 1:]
+    else:
+        epoch, rest = "0", evr
+    version, sep, release = rest.rpartition("-")
+    if not sep:
+        return epoch, rest, None
+    return epoch, version, release
+
+
+def vercmp(a, b):
+    """Same result as pyalpm.vercmp: <0, 0 or >0."""
+    if a == b:
+        return 0
+    epoch1, ver1, rel1 = _parse_evr(a)
+    epoch2, ver2, rel2 = _parse_evr(b)
+    ret = rpmvercmp(epoch1, epoch2)
+    if ret == 0:
+        ret = rpmvercmp(ver1, ver2)
+        if ret == 0 and rel1 is not None and rel2 is not None:
+            ret = rpmvercmp(rel1, rel2)
+    return ret
+
+
+def parse_depend(depend):
+    """Split a depend string like 'foo>=1.2' into (name, op, version)."""
+    match = DEPEND_RE.match(depend)
+    if not match:
+        return depend, None, None
+    return match.group(1), match.group(2), match.group(3)
+
+
+def version_satisfies(version, op, want):
+    if op is None:
+        return True
+    cmp = vercmp(version, want)
+    return {
+        '=': cmp == 0,
+        '>=': cmp >= 0,
+        '<=': cmp <= 0,
+        '>': cmp > 0,
+        '<': cmp < 0,
+    }[op]
+
+
+def main():
+    """Prints name, base and version of every package of the given db files."""
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <db file>...")
+        sys.exit(1)
+    signal(SIGPIPE, SIG_DFL)
+    for path, (names, bases, versions, _) in zip(sys.argv[1:], _read_many(sys.argv[1:])):
+        for name, base, version in zip(names, bases, versions):
+            print(f"{name} {base} {version}")
+
+if __name__ == "__main__":
+    main()
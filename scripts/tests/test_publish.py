@@ -0,0 +1,163 @@
+"""
+publish.py against temporary repo directories, signing with a throwaway key.
+
+Needs repo-add, rsync, bsdtar and gpg, like the build server. Run with
+
+    python -m unittest discover -s scripts/tests
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS)
+
+import publish  # noqa: E402
+import syncdb  # noqa: E402
+
+PUBLISH = os.path.join(SCRIPTS, "publish.py")
+TOOLS = ["repo-add", "rsync", "bsdtar", "gpg"]
+
+
+@unittest.skipUnless(all(shutil.which(tool) for tool in TOOLS), f"needs {', '.join(TOOLS)}")
+class PublishTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="publish-test-")
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.gnupghome = self.mkdir("gnupg")
+        os.chmod(self.gnupghome, 0o700)
+        subprocess.run(["gpg", "--batch", "--passphrase", "", "--quick-gen-key",
+                        "Publish Test <publish@localhost>", "ed25519", "sign", "never"],
+                       env=self.env(), check=True, capture_output=True)
+        self.spool = os.path.join(self.tmp, "spool")
+        self.builddir = self.mkdir("build")
+        self.extra = self.mkdir("repo/temp-extra/os/loong64")
+        self.core = self.mkdir("repo/temp-core/os/loong64")
+        self.debug_pool = self.mkdir("repo/debug-pool")
+
+    def mkdir(self, path):
+        path = os.path.join(self.tmp, path)
+        os.makedirs(path)
+        return path
+
+    def env(self):
+        return dict(os.environ, GNUPGHOME=self.gnupghome)
+
+    def package(self, name, version, content="", arch="loong64"):
+        """Builds a minimal package in the build directory, returns its file name."""
+        root = tempfile.mkdtemp(dir=self.tmp)
+        with open(os.path.join(root, ".PKGINFO"), "w") as f:
+            f.write(f"pkgname = {name}\npkgbase = {name}\npkgver = {version}\narch = {arch}\n"
+                    f"size = 0\nbuilddate = 0\npackager = Publish Test\n")
+        os.makedirs(os.path.join(root, "usr", "share", name))
+        with open(os.path.join(root, "usr", "share", name, "data"), "w") as f:
+            f.write(content or f"{name} {version}\n")
+        filename = f"{name}-{version}-{arch}.pkg.tar.zst"
+        subprocess.run(["bsdtar", "--zstd", "-cf", os.path.join(self.builddir, filename), "-C", root, ".PKGINFO", "usr"],
+                       check=True)
+        return filename
+
+    def publish(self, *args):
+        return subprocess.run([sys.executable, PUBLISH, "--spool", self.spool, "--sign-host", publish.LOCAL, *args],
+                              env=self.env(), capture_output=True, text=True)
+
+    def add(self, repo, db, *files, debug=None):
+        extra = ["--debug", debug, "--debug-pool", self.debug_pool] if debug else []
+        return self.publish("add", "--builder", publish.LOCAL, "--builddir", self.builddir,
+                            "--repo", repo, "--db", db, *extra, *files)
+
+    def versions(self, repo, db):
+        names, _, versions, _ = syncdb.read_db(os.path.join(repo, db))
+        return dict(zip(names, versions))
+
+    def assertSigned(self, path):
+        subprocess.run(["gpg", "--verify", path + ".sig", path], env=self.env(), check=True, capture_output=True)
+
+    def failed_jobs(self):
+        failed = os.path.join(self.spool, "failed")
+        return sorted(os.listdir(failed)) if os.path.isdir(failed) else []
+
+    def test_batch(self):
+        a = self.package("a", "1.0-1")
+        debug = self.package("a-debug", "1.0-1")
+        b = self.package("b", "2.0-1", arch="any")
+        c = self.package("c", "3.0-1")
+        publish.enqueue(self.spool, publish.LOCAL, self.builddir, self.extra, "temp-extra.db.tar.gz", [a],
+                        debug, self.debug_pool)
+        publish.enqueue(self.spool, publish.LOCAL, self.builddir, self.extra, "temp-extra.db.tar.gz", [b])
+        publish.enqueue(self.spool, publish.LOCAL, self.builddir, self.core, "temp-core.db.tar.gz", [c])
+
+        report = os.path.join(self.tmp, "report.jsonl")
+        result = self.publish("--report", report, "run", "--once")
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+        # All three builds went out in one batch
+        with open(report) as f:
+            batches = [json.loads(line) for line in f]
+        self.assertEqual(len(batches), 1)
+        self.assertEqual((batches[0]["jobs"], batches[0]["packages"]), (3, 3))
+
+        self.assertEqual(self.versions(self.extra, "temp-extra.db.tar.gz"), {"a": "1.0-1", "b": "2.0-1"})
+        self.assertEqual(self.versions(self.core, "temp-core.db.tar.gz"), {"c": "3.0-1"})
+        for path in (os.path.join(self.extra, a), os.path.join(self.extra, b), os.path.join(self.core, c),
+                     os.path.join(self.debug_pool, debug)):
+            self.assertSigned(path)
+        self.assertEqual([f for f in os.listdir(self.spool) if f.endswith(".json")], [])
+        self.assertEqual(self.failed_jobs(), [])
+
+    def test_replace(self):
+        db = "temp-extra.db.tar.gz"
+        old = self.package("a", "1.0-1")
+        self.assertEqual(self.add(self.extra, db, old).returncode, 0)
+
+        # A new version replaces the old one and its file, like repo-add -R
+        new = self.package("a", "1.0-2")
+        self.assertEqual(self.add(self.extra, db, new).returncode, 0)
+        self.assertEqual(self.versions(self.extra, db), {"a": "1.0-2"})
+        self.assertFalse(os.path.exists(os.path.join(self.extra, old)))
+        self.assertFalse(os.path.exists(os.path.join(self.extra, old + ".sig")))
+
+        # Publishing the same file name again keeps the new file
+        self.package("a", "1.0-2", content="rebuilt\n")
+        self.assertEqual(self.add(self.extra, db, new).returncode, 0)
+        self.assertEqual(self.versions(self.extra, db), {"a": "1.0-2"})
+        with open(os.path.join(self.builddir, new), "rb") as built, open(os.path.join(self.extra, new), "rb") as repo:
+            self.assertEqual(built.read(), repo.read())
+        self.assertSigned(os.path.join(self.extra, new))
+
+    def test_missing_package(self):
+        result = self.add(self.extra, "temp-extra.db.tar.gz", "nothere-1.0-1-loong64.pkg.tar.zst")
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("missing nothere-1.0-1-loong64.pkg.tar.zst", result.stderr)
+        self.assertEqual(len(self.failed_jobs()), 1)
+        self.assertEqual(os.listdir(self.extra), [])
+
+    def test_failed_repo_add(self):
+        # A db is only rolled back for its own builds, the others are published
+        old = self.package("c", "3.0-1")
+        self.assertEqual(self.add(self.core, "temp-core.db.tar.gz", old).returncode, 0)
+        a = self.package("a", "1.0-1")
+        broken = "c-3.0-2-loong64.pkg.tar.zst"
+        with open(os.path.join(self.builddir, broken), "w") as f:
+            f.write("not a package\n")
+        publish.enqueue(self.spool, publish.LOCAL, self.builddir, self.extra, "temp-extra.db.tar.gz", [a])
+        broken_job = publish.enqueue(self.spool, publish.LOCAL, self.builddir, self.core, "temp-core.db.tar.gz",
+                                     [broken])
+
+        result = self.publish("run", "--once")
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(self.versions(self.extra, "temp-extra.db.tar.gz"), {"a": "1.0-1"})
+        self.assertEqual(self.failed_jobs(), [os.path.basename(broken_job)])
+        self.assertEqual(self.versions(self.core, "temp-core.db.tar.gz"), {"c": "3.0-1"})
+        self.assertFalse(os.path.exists(os.path.join(self.core, broken)))
+        self.assertSigned(os.path.join(self.core, old))
+
+
+if __name__ == "__main__":
+    unittest.main()